@@ -0,0 +1,82 @@
+# Copyright 2016, 2021 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Serialization benchmark
+
+Times the cost per order of turning a list of orders into a JSON response
+body, the way GET /orders used to do it (marshal_list_with + jsonify) and
+the way it does it now (compiled serializer + dumps). No database rows are
+read, the orders are built in memory.
+
+Run it from the root of the repository with:
+    DATABASE_URI=sqlite:////tmp/bench.db python -m benchmarks.bench_serialization
+"""
+import argparse
+import timeit
+from flask import jsonify
+from flask_restx import marshal
+from service.models import CustomerOrder, Item, Status
+from service.routes import app, order_model, serialize_order
+from service.serialization import dumps, orjson
+
+
+def make_orders(count, items):
+    """Builds orders with their items in memory"""
+    statuses = list(Status)
+    return [
+        CustomerOrder(
+            id=order_id, customer_id=order_id % 97, address=f"{order_id} Main Street",
+            status=statuses[order_id % len(statuses)], version=1,
+            items=[Item(id=order_id * items + i, order_id=order_id, quantity=i + 1,
+                        price=9.99, item_name=f"item {i}") for i in range(items)],
+        )
+        for order_id in range(1, count + 1)
+    ]
+
+
+def marshal_path(orders):
+    """The response body as built before: marshal() then jsonify()"""
+    return jsonify(marshal([order.serialize() for order in orders], order_model)).get_data()
+
+
+def compiled_path(orders):
+    """The response body as built now: compiled serializer then dumps()"""
+    return dumps([serialize_order(order.serialize()) for order in orders])
+
+
+def main():
+    """Runs the benchmark and prints the cost per order of both paths"""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--orders", type=int, default=1000, help="orders per response")
+    parser.add_argument("--items", type=int, default=5, help="items per order")
+    parser.add_argument("--repeat", type=int, default=5, help="best of this many runs")
+    args = parser.parse_args()
+
+    orders = make_orders(args.orders, args.items)
+    print(f"{args.orders} orders with {args.items} items each, "
+          f"JSON encoder: {'orjson' if orjson else 'json'}")
+    results = {}
+    with app.test_request_context():
+        for name, path in (("marshal + jsonify", marshal_path),
+                           ("compiled + dumps", compiled_path)):
+            best = min(timeit.repeat(lambda path=path: path(orders), number=1, repeat=args.repeat))
+            results[name] = best / args.orders * 1e6
+            print(f"{name:>20}: {results[name]:8.2f} us/order")
+    before, after = results.values()
+    print(f"{'speedup':>20}: {before / after:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+# Copyright 2016, 2021 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Worker class benchmark
+
+Starts the service under gunicorn once per worker class, with a single
+worker each, and sends the same concurrent load of GET requests to it.
+The sync worker serves one request at a time; the gevent worker keeps
+requests in flight while they wait on the database, so the difference
+grows with the latency of the database.
+
+Run it from the root of the repository against a scratch Postgres
+database with:
+    DATABASE_URI=postgres://... python -m benchmarks.bench_workers
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.request import Request, urlopen
+
+
+def free_port():
+    """Returns a TCP port nothing listens on"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(worker_class, port, workers=1):
+    """Starts gunicorn with a worker class and waits until it answers
+
+    Raises CalledProcessError if gunicorn exits before it answers
+    """
+    env = dict(os.environ, PORT=str(port), GUNICORN_WORKER_CLASS=worker_class,
+               GUNICORN_WORKERS=str(workers))
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "--log-level=warning",
+         "service:app"],
+        env=env,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise subprocess.CalledProcessError(server.returncode, server.args)
+        try:
+            urlopen(f"http://127.0.0.1:{port}/", timeout=1).close()
+            return server
+        except OSError:  # refused, reset or timed out while the workers boot
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError(f"gunicorn with {worker_class} workers did not start")
+
+
+def seed(base_url, count):
+    """Adds orders with items to the database"""
+    orders = [
+        {"customer_id": i % 97, "address": f"{i} Main Street", "status": "Received",
+         "items": [{"quantity": 1, "price": 9.99, "item_name": f"item {j}"} for j in range(5)]}
+        for i in range(count)
+    ]
+    request = Request(f"{base_url}/orders/batch", data=json.dumps(orders).encode("utf-8"),
+                      headers={"Content-Type": "application/json"})
+    with urlopen(request) as resp:
+        return json.load(resp)["created"]
+
+
+def timed_get(url):
+    """GETs a URL and returns how long it took in seconds, or None on error"""
+    start = time.perf_counter()
+    try:
+        with urlopen(url, timeout=60) as resp:
+            resp.read()
+    except OSError:
+        return None
+    return time.perf_counter() - start
+
+
+def run_load(urls, concurrency):
+    """Sends the requests with concurrency at a time and returns the results"""
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        timings = list(pool.map(timed_get, urls))
+    elapsed = time.perf_counter() - start
+    latencies = sorted(timing for timing in timings if timing is not None)
+    if not latencies:
+        return {"rps": 0.0, "p50": 0.0, "p99": 0.0, "errors": len(timings)}
+    return {
+        "rps": len(latencies) / elapsed,
+        "p50": statistics.median(latencies) * 1000,
+        "p99": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000,
+        "errors": len(timings) - len(latencies),
+    }
+
+
+def main():
+    """Runs the benchmark for each worker class and prints the results"""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=2000, help="requests per worker class")
+    parser.add_argument("--concurrency", type=int, default=100, help="requests in flight")
+    parser.add_argument("--orders", type=int, default=200, help="orders to seed")
+    parser.add_argument("--path", default="/orders?limit=50",
+                        help="path to GET besides the single orders")
+    parser.add_argument("--workers", nargs="+", default=["sync", "gevent"],
+                        help="gunicorn worker classes to compare")
+    args = parser.parse_args()
+
+    order_ids = None
+    print(f"{args.requests} requests, {args.concurrency} in flight, one gunicorn worker")
+    for worker_class in args.workers:
+        port = free_port()
+        base_url = f"http://127.0.0.1:{port}"
+        server = start_server(worker_class, port)
+        try:
+            if order_ids is None:
+                order_ids = seed(base_url, args.orders)
+            paths = [args.path] + [f"/orders/{order_id}" for order_id in order_ids]
+            urls = [base_url + paths[i % len(paths)] for i in range(args.requests)]
+            result = run_load(urls, args.concurrency)
+        finally:
+            server.terminate()
+            server.wait()
+        print(f"{worker_class:>8}: {result['rps']:8.1f} req/s  p50 {result['p50']:7.1f} ms  "
+              f"p99 {result['p99']:7.1f} ms  errors {result['errors']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+# Copyright 2016, 2021 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Synthetic data generator
+
+Adds orders with their items to the database of DATABASE_URI, shaped like
+production data rather than like the test factories:
+
+    - a few customers place most of the orders (Zipf distributed)
+    - most orders have one to three items, a few have many
+    - a few products are in most orders, each with its own catalog price
+    - most orders are Completed, a few Received, Processing, Cancelled or
+      Returned
+
+The rows are loaded in chunks without the ORM: with COPY on Postgres and
+with executemany() INSERTs elsewhere. Order ids carry on from the largest
+one in the table, so run it while nothing else writes orders.
+
+Run it from the root of the repository with:
+    DATABASE_URI=postgres://... python -m benchmarks.generate_data --orders 1000000
+"""
+import argparse
+import bisect
+import io
+import itertools
+import math
+import random
+import time
+from sqlalchemy import func, text
+from service import app
+from service.models import db, upgrade_db, CustomerOrder, Item, Status, TOTAL_PLACES
+
+STATUS_MIX = {
+    Status.Received: 10,
+    Status.Processing: 15,
+    Status.Completed: 65,
+    Status.Cancelled: 7,
+    Status.Returned: 3,
+}
+STREETS = ["Main Street", "Broadway", "Park Avenue", "Elm Street", "Lake Road", "Hill Lane"]
+
+
+def zipf_cum_weights(count, skew):
+    """Cumulative weights that make rank k as likely as 1 / k ** skew"""
+    return list(itertools.accumulate(1 / rank ** skew for rank in range(1, count + 1)))
+
+
+class Generator:
+    """Generates orders and items with realistic distributions"""
+
+    def __init__(self, customers, products, items_mean, skew, seed=None):
+        self.rng = random.Random(seed)
+        self.customer_weights = zipf_cum_weights(customers, skew)
+        self.product_weights = zipf_cum_weights(products, skew)
+        self.prices = [round(self.rng.lognormvariate(3, 1), 2) for _ in range(products)]
+        self.statuses = list(STATUS_MIX)
+        self.status_weights = list(itertools.accumulate(STATUS_MIX.values()))
+        # the items of an order beyond the first are geometrically
+        # distributed: the whole part of an exponential of this rate
+        self.extra_items = math.log1p(1 / (items_mean - 1)) if items_mean > 1 else None
+
+    def _pick(self, cum_weights):
+        """Picks the index of a weighted choice"""
+        return bisect.bisect(cum_weights, self.rng.random() * cum_weights[-1])
+
+    def items_in_order(self):
+        """Returns how many items a new order has"""
+        if self.extra_items is None:
+            return 1
+        return min(1 + int(self.rng.expovariate(self.extra_items)), 50)
+
+    def orders(self, first_id, count):
+        """Returns the order rows and the item rows of count new orders
+
+        Rows are tuples, (id, customer_id, address, status name, version,
+        item_count, total_price) for the orders and (order_id, quantity,
+        price, item_name) for the items.
+        """
+        rng = self.rng
+        orders, items = [], []
+        for order_id in range(first_id, first_id + count):
+            customer_id = self._pick(self.customer_weights) + 1
+            address = f"{rng.randint(1, 9999)} {STREETS[order_id % len(STREETS)]}"
+            status = self.statuses[self._pick(self.status_weights)].name
+            item_count = self.items_in_order()
+            total_price = 0.0
+            for _ in range(item_count):
+                product = self._pick(self.product_weights)
+                quantity = 1 + int(rng.expovariate(1.5))
+                total_price += quantity * self.prices[product]
+                items.append((order_id, quantity, self.prices[product], f"product {product}"))
+            orders.append((order_id, customer_id, address, status, 1, item_count,
+                           round(total_price, TOTAL_PLACES)))
+        return orders, items
+
+
+def copy_rows(table, columns, rows):
+    """Loads rows into a Postgres table with COPY"""
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write("\t".join(str(value) for value in row))
+        buffer.write("\n")
+    buffer.seek(0)
+    connection = db.session.connection().connection
+    with connection.cursor() as cursor:
+        cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buffer)
+
+
+def insert_rows(table, columns, rows):
+    """Loads rows into a table with a single executemany() INSERT"""
+    dialect = db.engine.dialect
+    statement = str(table.insert().compile(dialect=dialect, column_keys=columns))
+    if not dialect.positional:
+        rows = [dict(zip(columns, row)) for row in rows]
+    # straight to the DBAPI cursor, SQLAlchemy would turn every row into a dict
+    cursor = db.session.connection().connection.cursor()
+    try:
+        cursor.executemany(statement, rows)
+    finally:
+        cursor.close()
+
+
+def move_order_sequence():
+    """Moves the Postgres sequence of the order ids past the largest id
+
+    Needed after orders are inserted with explicit ids, or the next order
+    created through the model gets an id that is already taken
+    """
+    if db.engine.dialect.name == "postgresql":
+        db.session.execute(text(
+            "SELECT setval(pg_get_serial_sequence('customer_order', 'id'), "
+            "(SELECT MAX(id) FROM customer_order))"
+        ))
+        db.session.commit()
+
+
+ORDER_COLUMNS = ("id", "customer_id", "address", "status", "version", "item_count",
+                 "total_price")
+ITEM_COLUMNS = ("order_id", "quantity", "price", "item_name")
+
+
+def load(generator, count, chunk_size=50000, progress=None):
+    """Generates count orders and loads them chunk by chunk
+
+    :return: the number of orders and of items loaded
+    :rtype: tuple
+
+    """
+    postgres = db.engine.dialect.name == "postgresql"
+    first_id = (db.session.query(func.max(CustomerOrder.id)).scalar() or 0) + 1
+    loaded_items = 0
+    for start in range(0, count, chunk_size):
+        orders, items = generator.orders(first_id + start, min(chunk_size, count - start))
+        if postgres:
+            copy_rows(CustomerOrder.__tablename__, ORDER_COLUMNS, orders)
+            copy_rows(Item.__tablename__, ITEM_COLUMNS, items)
+        else:
+            insert_rows(CustomerOrder.__table__, ORDER_COLUMNS, orders)
+            insert_rows(Item.__table__, ITEM_COLUMNS, items)
+        db.session.commit()
+        loaded_items += len(items)
+        if progress:
+            progress(start + len(orders), loaded_items)
+    if count:
+        # the ids were given explicitly
+        move_order_sequence()
+    CustomerOrder.cache.clear()
+    return count, loaded_items
+
+
+def main():
+    """Generates the orders asked for"""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--orders", type=int, default=100000, help="orders to add")
+    parser.add_argument("--customers", type=int, help="distinct customers (default orders / 10)")
+    parser.add_argument("--products", type=int, default=5000, help="distinct item names")
+    parser.add_argument("--items-mean", type=float, default=2.5, help="average items per order")
+    parser.add_argument("--skew", type=float, default=1.0,
+                        help="Zipf exponent of the customer and product popularity")
+    parser.add_argument("--chunk-size", type=int, default=50000, help="orders per transaction")
+    parser.add_argument("--seed", type=int, help="random seed, for repeatable data")
+    parser.add_argument("--truncate", action="store_true", help="empty the tables first")
+    args = parser.parse_args()
+
+    app.logger.setLevel("WARNING")
+    app.config["SLOW_QUERY_THRESHOLD"] = 0
+    upgrade_db()
+    if args.truncate:
+        db.session.query(Item).delete()
+        db.session.query(CustomerOrder).delete()
+        db.session.commit()
+    generator = Generator(args.customers or max(1, args.orders // 10), args.products,
+                          args.items_mean, args.skew, args.seed)
+    start = time.perf_counter()
+
+    def progress(orders, items):
+        elapsed = time.perf_counter() - start
+        print(f"{orders} orders, {items} items, {(orders + items) / elapsed:,.0f} rows/s")
+
+    orders, items = load(generator, args.orders, args.chunk_size, progress)
+    elapsed = time.perf_counter() - start
+    print(f"Loaded {orders} orders and {items} items in {elapsed:.1f}s into "
+          f"{db.engine.dialect.name}")
+
+
+if __name__ == "__main__":
+    main()
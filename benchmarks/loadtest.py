@@ -0,0 +1,336 @@
+# Copyright 2016, 2021 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+HTTP load test
+
+Sends a mix of requests to the service at a target rate for a while and
+reports the throughput and the p50/p95/p99 latencies of every endpoint:
+
+    create        - POST /orders
+    add_item      - POST /orders/<id>/items
+    get           - GET /orders/<id>
+    list_customer - GET /orders?customer_id=<id>
+    list_item     - GET /orders?item=<name>
+    cancel        - PUT /orders/<id>/cancel
+    delete        - DELETE /orders/<id>
+
+Requests are started on a fixed schedule whether or not the earlier ones
+are done, and their latency is counted from when they were due, so a
+server that falls behind shows it in the percentiles instead of slowing
+the test down. Responses with a 5xx status or that fail count as errors.
+The test stops as soon as the service refuses a connection, or the
+gunicorn it started exits, instead of timing out every request left.
+
+Run it against a service that is already running:
+    python -m benchmarks.loadtest --url http://localhost:5000 --rate 200 --duration 60
+or let it start gunicorn, with a given worker class, on the DATABASE_URI:
+    DATABASE_URI=sqlite:////tmp/load.db python -m benchmarks.loadtest --start gthread --workers 2
+"""
+import argparse
+import http.client
+import json
+import random
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urlsplit
+from benchmarks.bench_workers import free_port, start_server
+
+DEFAULT_MIX = "create=10,add_item=10,get=40,list_customer=20,list_item=10,cancel=5,delete=5"
+CUSTOMERS = 1000
+ITEM_NAMES = [f"product {i}" for i in range(200)]
+
+
+class ServerDown(Exception):
+    """The service stopped accepting connections"""
+
+
+class Client:
+    """Sends requests over a keep-alive connection per thread"""
+
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self._local = threading.local()
+
+    def request(self, method, path, body=None):
+        """Sends a request and returns its status and decoded JSON body"""
+        headers = {"Accept": "application/json"}
+        data = None
+        if body is not None:
+            data = json.dumps(body)
+            headers["Content-Type"] = "application/json"
+        for attempt in range(2):
+            connection = getattr(self._local, "connection", None)
+            if connection is None:
+                connection = http.client.HTTPConnection(self.host, self.port, timeout=60)
+                self._local.connection = connection
+            try:
+                connection.request(method, path, data, headers)
+                resp = connection.getresponse()
+                payload = resp.read()
+                break
+            except ConnectionRefusedError:
+                # nothing listens on the port, trying again won't help
+                connection.close()
+                self._local.connection = None
+                raise
+            except (http.client.HTTPException, OSError):
+                connection.close()
+                self._local.connection = None
+                if attempt:
+                    raise
+        if payload and resp.getheader("Content-Type", "").startswith("application/json"):
+            return resp.status, json.loads(payload)
+        return resp.status, None
+
+
+class Workload:
+    """The requests of the mix, over the orders the test knows about"""
+
+    def __init__(self, client, seed):
+        self.client = client
+        self.rng = random.Random(seed)
+        self.order_ids = []
+        self.lock = threading.Lock()
+
+    def _new_order(self):
+        return {"customer_id": self.rng.randrange(CUSTOMERS), "address": "1 Load Street",
+                "status": "Received"}
+
+    def _new_item(self, order_id):
+        return {"order_id": order_id, "quantity": self.rng.randint(1, 5),
+                "price": round(self.rng.uniform(1, 100), 2),
+                "item_name": self.rng.choice(ITEM_NAMES)}
+
+    def _some_order(self, remove=False):
+        with self.lock:
+            if not self.order_ids:
+                return 0
+            index = self.rng.randrange(len(self.order_ids))
+            if remove:
+                # swap with the last one to remove it in constant time
+                ids = self.order_ids
+                ids[index], ids[-1] = ids[-1], ids[index]
+                return ids.pop()
+            return self.order_ids[index]
+
+    def seed(self, count):
+        """Adds count orders with a few items each"""
+        for start in range(0, count, 1000):
+            orders = [dict(self._new_order(), items=[
+                {key: value for key, value in self._new_item(0).items() if key != "order_id"}
+                for _ in range(self.rng.randint(1, 5))
+            ]) for _ in range(min(1000, count - start))]
+            code, body = self.client.request("POST", "/orders/batch", orders)
+            if code != 201:
+                raise RuntimeError(f"seeding failed with status {code}")
+            self.order_ids.extend(body["created"])
+
+    def create(self):
+        """POST /orders"""
+        code, body = self.client.request("POST", "/orders", self._new_order())
+        if code == 201:
+            with self.lock:
+                self.order_ids.append(body["id"])
+        return code
+
+    def add_item(self):
+        """POST /orders/<id>/items"""
+        order_id = self._some_order()
+        return self.client.request("POST", f"/orders/{order_id}/items",
+                                   self._new_item(order_id))[0]
+
+    def get(self):
+        """GET /orders/<id>"""
+        return self.client.request("GET", f"/orders/{self._some_order()}")[0]
+
+    def list_customer(self):
+        """GET /orders?customer_id=<id>"""
+        customer_id = self.rng.randrange(CUSTOMERS)
+        return self.client.request("GET", f"/orders?customer_id={customer_id}")[0]
+
+    def list_item(self):
+        """GET /orders?item=<name>"""
+        name = self.rng.choice(ITEM_NAMES).replace(" ", "%20")
+        return self.client.request("GET", f"/orders?item={name}")[0]
+
+    def cancel(self):
+        """PUT /orders/<id>/cancel"""
+        return self.client.request("PUT", f"/orders/{self._some_order()}/cancel")[0]
+
+    def delete(self):
+        """DELETE /orders/<id>"""
+        return self.client.request("DELETE", f"/orders/{self._some_order(remove=True)}")[0]
+
+
+def parse_mix(mix):
+    """Parses "name=weight,..." into a list of names and a list of weights"""
+    names, weights = [], []
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        if not hasattr(Workload, name.strip()) or name.strip().startswith("_"):
+            raise argparse.ArgumentTypeError(f"unknown endpoint {name!r}")
+        names.append(name.strip())
+        weights.append(float(weight or 1))
+    return names, weights
+
+
+def run(workload, mix, rate, duration, concurrency, server=None):
+    """Sends requests at rate per second for duration seconds
+
+    Raises ServerDown as soon as a connection is refused or the server
+    process, if there is one, exits
+    """
+    names, weights = mix
+    total = int(rate * duration)
+    schedule = random.Random(1).choices(names, weights, k=total)
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    results_lock = threading.Lock()
+    next_request = iter(range(total))
+    next_lock = threading.Lock()
+    start = time.perf_counter() + 0.1
+    down = threading.Event()
+
+    def worker():
+        while not down.is_set():
+            if server is not None and server.poll() is not None:
+                down.set()
+                return
+            with next_lock:
+                index = next(next_request, None)
+            if index is None:
+                return
+            due = start + index / rate
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            name = schedule[index]
+            try:
+                failed = getattr(workload, name)() >= 500
+            except ConnectionRefusedError:
+                down.set()
+                return
+            except (http.client.HTTPException, OSError, ValueError):
+                failed = True
+            elapsed = time.perf_counter() - due
+            with results_lock:
+                latencies[name].append(elapsed)
+                errors[name] += failed
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if down.is_set():
+        raise ServerDown("the service stopped accepting connections")
+    return latencies, errors, time.perf_counter() - start
+
+
+def percentile(values, fraction):
+    """Returns the nearest-rank percentile of sorted values"""
+    return values[min(len(values) - 1, max(0, int(round(fraction * len(values))) - 1))]
+
+
+def report(latencies, errors, elapsed):
+    """Prints and returns the throughput and latencies of every endpoint"""
+    summary = {}
+    everything = sorted(value for values in latencies.values() for value in values)
+    rows = [(name, sorted(values)) for name, values in sorted(latencies.items())]
+    rows.append(("total", everything))
+    print(f"{'endpoint':>14} {'requests':>9} {'errors':>7} {'req/s':>8} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for name, values in rows:
+        if not values:
+            continue
+        failed = sum(errors.values()) if name == "total" else errors[name]
+        summary[name] = {
+            "requests": len(values), "errors": failed, "rps": len(values) / elapsed,
+            "p50": percentile(values, 0.50) * 1000, "p95": percentile(values, 0.95) * 1000,
+            "p99": percentile(values, 0.99) * 1000, "max": values[-1] * 1000,
+        }
+        row = summary[name]
+        print(f"{name:>14} {row['requests']:>9} {row['errors']:>7} {row['rps']:>8.1f} "
+              f"{row['p50']:>8.1f} {row['p95']:>8.1f} {row['p99']:>8.1f} {row['max']:>8.1f}")
+    return summary
+
+
+def abort(message, status=None):
+    """Stops the test with the exit status of the server, if it exited with one"""
+    print(f"Load test aborted: {message}", file=sys.stderr)
+    sys.exit(status if status and status > 0 else 1)
+
+
+def main():
+    """Runs the load test"""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--url", help="URL of a running service")
+    parser.add_argument("--start", metavar="WORKER_CLASS",
+                        help="start gunicorn with this worker class instead of using --url")
+    parser.add_argument("--workers", type=int, default=1, help="gunicorn workers to --start")
+    parser.add_argument("--rate", type=float, default=100, help="requests started per second")
+    parser.add_argument("--duration", type=float, default=30, help="seconds to send requests for")
+    parser.add_argument("--concurrency", type=int, default=64,
+                        help="most requests in flight at once")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f"endpoints and their weights (default {DEFAULT_MIX})")
+    parser.add_argument("--seed", type=int, default=1000, help="orders to add before starting")
+    parser.add_argument("--output", help="file to write the results to as JSON")
+    args = parser.parse_args()
+    if not args.url and not args.start:
+        parser.error("either --url or --start is needed")
+
+    server = None
+    url = args.url
+    if args.start:
+        port = free_port()
+        try:
+            server = start_server(args.start, port, args.workers)
+        except subprocess.CalledProcessError as error:
+            abort(f"gunicorn exited with status {error.returncode} while starting",
+                  error.returncode)
+        except RuntimeError as error:
+            abort(error)
+        url = f"http://127.0.0.1:{port}"
+    try:
+        workload = Workload(Client(url), seed=0)
+        workload.seed(args.seed)
+        print(f"{args.rate:.0f} req/s for {args.duration:.0f}s against {url}, "
+              f"at most {args.concurrency} in flight")
+        latencies, errors, elapsed = run(workload, args.mix, args.rate, args.duration,
+                                         args.concurrency, server)
+    except (ServerDown, ConnectionRefusedError) as error:
+        if server is not None and server.poll() is not None:
+            abort(f"gunicorn exited with status {server.returncode}", server.returncode)
+        abort(error)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+    summary = report(latencies, errors, elapsed)
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump({"url": url, "rate": args.rate, "duration": args.duration,
+                       "worker_class": args.start, "workers": args.workers,
+                       "endpoints": summary}, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
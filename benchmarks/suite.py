@@ -0,0 +1,209 @@
+# Copyright 2016, 2021 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Micro-benchmark suite for the models and the serialization
+
+For every table size asked for, the tables are emptied and filled with that
+many orders (three items each), then each operation below is timed and its
+best time per call, in microseconds, is kept:
+
+    create                 - CustomerOrder.create() of a new order
+    find                   - CustomerOrder.find() of a random order
+    find_by_customer_id    - the orders of a random customer
+    find_by_including_item - the first page of the orders with a random item
+    serialize              - CustomerOrder.serialize() of a loaded order
+    deserialize            - CustomerOrder.deserialize() of a request body
+    list_endpoint          - GET /orders?limit=100 through the test client
+
+The results are written as JSON. Given the results of an earlier run as a
+baseline, every operation that got slower by more than the tolerance is
+reported and the exit status is 1.
+
+Run it from the root of the repository with:
+    python -m benchmarks.suite --sizes 1000 100000 --output results.json
+    python -m benchmarks.suite --sizes 1000 100000 --baseline results.json
+It uses a SQLite database in /tmp unless DATABASE_URI is set. Since every
+size drops and recreates the tables, another DATABASE_URI must be confirmed
+with --drop-tables.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+import timeit
+
+SCRATCH_DATABASE = "sqlite:////tmp/orders-bench.db"
+os.environ.setdefault("DATABASE_URI", SCRATCH_DATABASE)
+
+# pylint: disable=wrong-import-position
+import sqlalchemy
+from service import app
+from service.models import db, bulk_insert, CustomerOrder, Item, Status, TOTAL_PLACES
+from benchmarks.generate_data import move_order_sequence
+
+ITEMS_PER_ORDER = 3
+ITEM_NAMES = [f"product {i}" for i in range(1000)]
+CHUNK_SIZE = 10000
+
+
+def seed(count):
+    """Empties the tables and fills them with count orders and their items"""
+    db.session.remove()
+    db.drop_all()
+    db.create_all()
+    rng = random.Random(count)
+    statuses = list(Status)
+    customers = max(1, count // 10)
+    for start in range(1, count + 1, CHUNK_SIZE):
+        order_ids = range(start, min(start + CHUNK_SIZE, count + 1))
+        items = [
+            {"order_id": order_id, "quantity": rng.randint(1, 5),
+             "price": round(rng.uniform(1, 100), 2), "item_name": rng.choice(ITEM_NAMES)}
+            for order_id in order_ids for _ in range(ITEMS_PER_ORDER)
+        ]
+        totals = dict.fromkeys(order_ids, 0.0)
+        for item in items:
+            totals[item["order_id"]] += item["quantity"] * item["price"]
+        bulk_insert(CustomerOrder.__table__, [
+            {"id": order_id, "customer_id": rng.randrange(customers),
+             "address": f"{order_id} Main Street", "status": rng.choice(statuses), "version": 1,
+             "item_count": ITEMS_PER_ORDER, "total_price": round(totals[order_id], TOTAL_PLACES)}
+            for order_id in order_ids
+        ], return_ids=False)
+        bulk_insert(Item.__table__, items, return_ids=False)
+        db.session.commit()
+    # the ids were given explicitly, the create benchmark needs new ones
+    move_order_sequence()
+    return customers
+
+
+def benchmarks(count, customers):
+    """Returns the operations to time, with the number of calls per run"""
+    rng = random.Random(0)
+    client = app.test_client()
+    order = CustomerOrder.find(rng.randint(1, count))
+    data = order.serialize()
+    # detach the order, loaded, so that commits don't expire it
+    for item in order.items:
+        db.session.expunge(item)
+    db.session.expunge(order)
+
+    def create():
+        CustomerOrder(customer_id=rng.randrange(customers), address="1 New Street",
+                      status=Status.Received).create()
+
+    def find():
+        CustomerOrder.find(rng.randint(1, count))
+
+    def find_by_customer_id():
+        CustomerOrder.find_by_customer_id(rng.randrange(customers)).all()
+
+    def find_by_including_item():
+        CustomerOrder.keyset_page(
+            CustomerOrder.find_by_including_item(rng.choice(ITEM_NAMES)), 100)
+
+    def list_endpoint():
+        client.get("/orders?limit=100")
+
+    return {
+        "create": (create, 100),
+        "find": (find, 500),
+        "find_by_customer_id": (find_by_customer_id, 500),
+        "find_by_including_item": (find_by_including_item, 50),
+        "serialize": (order.serialize, 10000),
+        "deserialize": (lambda: CustomerOrder().deserialize(data), 10000),
+        "list_endpoint": (list_endpoint, 20),
+    }
+
+
+def run(sizes, repeat):
+    """Seeds and times every operation for every size"""
+    results = {}
+    for count in sizes:
+        start = time.perf_counter()
+        customers = seed(count)
+        print(f"{count} orders seeded in {time.perf_counter() - start:.1f}s")
+        results[str(count)] = {}
+        for name, (operation, number) in benchmarks(count, customers).items():
+            best = min(timeit.repeat(operation, number=number, repeat=repeat)) / number
+            results[str(count)][name] = best * 1e6
+            print(f"{name:>24}: {best * 1e6:10.1f} us")
+            db.session.remove()
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Prints how the results compare with a baseline and returns the regressions"""
+    regressions = []
+    for size, timings in results.items():
+        for name, current in timings.items():
+            before = baseline.get(size, {}).get(name)
+            if before is None:
+                continue
+            ratio = current / before
+            flag = ""
+            if ratio > 1 + tolerance:
+                flag = "  REGRESSION"
+                regressions.append((size, name, ratio))
+            print(f"{size:>8} {name:>24}: {before:10.1f} -> {current:10.1f} us "
+                  f"({ratio:5.2f}x){flag}")
+    return regressions
+
+
+def main():
+    """Runs the suite and compares it with the baseline"""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 100000],
+                        help="numbers of orders to time the operations with, such as 1000000")
+    parser.add_argument("--repeat", type=int, default=3, help="best of this many runs")
+    parser.add_argument("--output", help="file to write the results to")
+    parser.add_argument("--baseline", help="results of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="slowdown over the baseline that counts as a regression")
+    parser.add_argument("--drop-tables", action="store_true",
+                        help="allow the tables of a DATABASE_URI other than the default "
+                             "scratch database to be dropped")
+    args = parser.parse_args()
+    if os.environ["DATABASE_URI"] != SCRATCH_DATABASE and not args.drop_tables:
+        parser.error("the tables of DATABASE_URI are dropped for every size, "
+                     "pass --drop-tables if it is a scratch database")
+
+    app.logger.setLevel("WARNING")
+    app.config["SLOW_QUERY_THRESHOLD"] = 0
+    results = run(args.sizes, args.repeat)
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump({
+                "environment": {
+                    "python": platform.python_version(),
+                    "sqlalchemy": sqlalchemy.__version__,
+                    "database": db.engine.dialect.name,
+                    "date": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                },
+                "results": results,
+            }, output, indent=2)
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            regressions = compare(results, json.load(baseline)["results"], args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} operations are more than {args.tolerance:.0%} slower")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
 import json
 import os
 import logging
+import tempfile
 
 # Get configuration from environment
 DATABASE_URI = os.getenv(
@@ -18,4 +19,57 @@ SQLALCHEMY_TRACK_MODIFICATIONS = False
 
 # Secret for session management
 SECRET_KEY = os.getenv("SECRET_KEY", "sup3r-s3cr3t")
-LOGGING_LEVEL = logging.INFO
\ No newline at end of file
+LOGGING_LEVEL = logging.INFO
+
+# Keyset pagination of order listings
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE", "100"))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "1000"))
+# Orders read per query when streaming the whole list
+STREAM_CHUNK_SIZE = int(os.getenv("STREAM_CHUNK_SIZE", "500"))
+
+# Cache of serialized orders: "lru", "null" or "module:CacheBackendClass"
+ORDER_CACHE_BACKEND = os.getenv("ORDER_CACHE_BACKEND", "lru")
+ORDER_CACHE_SIZE = int(os.getenv("ORDER_CACHE_SIZE", "10000"))
+# Seconds a cached order lives; entries are checked against the order
+# version before use, so this only bounds how long unused entries are kept
+ORDER_CACHE_TTL = float(os.getenv("ORDER_CACHE_TTL", "10"))
+
+# Largest number of entries accepted by the batch endpoints
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "5000"))
+
+# Response compression (gzip, or brotli when the brotli package is installed)
+COMPRESSION_ENABLED = os.getenv("COMPRESSION_ENABLED", "true").lower() in ("1", "true", "yes")
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+COMPRESSION_BROTLI_LEVEL = int(os.getenv("COMPRESSION_BROTLI_LEVEL", "4"))
+# Smaller buffered responses, such as a single order, are sent uncompressed
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1400"))
+COMPRESSION_MIMETYPES = ("application/json", "application/x-ndjson")
+
+# Connection pool of each worker, not used with SQLite. Options set in
+# SQLALCHEMY_ENGINE_OPTIONS override these.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+# Seconds to wait for a connection when all of them are in use
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# Seconds after which a connection is replaced, before the server drops it
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+DB_CONNECT_TIMEOUT = int(os.getenv("DB_CONNECT_TIMEOUT", "10"))
+# Set when DATABASE_URI points at PgBouncer in transaction pooling mode
+DB_PGBOUNCER = os.getenv("DB_PGBOUNCER", "false").lower() in ("1", "true", "yes")
+SQLALCHEMY_ENGINE_OPTIONS = {}
+
+# Statements slower than this many seconds are logged, 0 logs none
+SLOW_QUERY_THRESHOLD = float(os.getenv("SLOW_QUERY_THRESHOLD", "0.5"))
+# Send the SQL time of each request in a Server-Timing header, which debug
+# mode always does
+SERVER_TIMING = os.getenv("SERVER_TIMING", "false").lower() in ("1", "true", "yes")
+
+# On-demand profiling of requests sent with an X-Profile header or a
+# profile query parameter; leave it off unless diagnosing
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() in ("1", "true", "yes")
+PROFILING_DIR = os.getenv("PROFILING_DIR", os.path.join(tempfile.gettempdir(), "orders-profiles"))
+# Seconds between the samples of the collapsed stack profiler
+PROFILING_INTERVAL = float(os.getenv("PROFILING_INTERVAL", "0.001"))
+# Profiles kept on disk, the oldest are deleted
+PROFILING_KEEP = int(os.getenv("PROFILING_KEEP", "100"))
@@ -1,6 +1,116 @@
+import glob
+import multiprocessing
 import os
+import shutil
+import subprocess
+import sys
+import tempfile
 
 PORT = os.getenv("PORT", "5000")
 bind = "0.0.0.0:" + PORT
-workers = 1
-log_level = "info"
+loglevel = os.getenv("GUNICORN_LOG_LEVEL", "info")
+
+# "sync" serves one request at a time per worker, "gthread" serves up to
+# threads requests at a time per worker. "gevent" serves every request in
+# its own greenlet, so while one waits on Postgres the worker goes on with
+# the others, up to worker_connections at a time.
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "sync")
+# Every worker has a connection pool of its own, so an instance opens up to
+# workers x (DB_POOL_SIZE + DB_MAX_OVERFLOW) connections, 15 per worker by
+# default. The Procfile and the Dockerfile leave the count to this default;
+# set GUNICORN_WORKERS wherever the database limits connections.
+workers = int(os.getenv("GUNICORN_WORKERS", str(multiprocessing.cpu_count() * 2 + 1)))
+threads = int(os.getenv("GUNICORN_THREADS", "4" if worker_class == "gthread" else "1"))
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "1000"))
+
+# Loading the app once in the master makes workers start faster and share
+# memory. Leave it off with gevent, which has to patch before the app loads.
+preload_app = os.getenv("GUNICORN_PRELOAD", "false").lower() in ("1", "true", "yes")
+
+# Seconds to hold an idle connection open; keep it above the idle timeout
+# of the load balancer in front so it never reuses a closed connection
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+# Recycle workers after this many requests (0 never does) to bound leaks,
+# with jitter so they don't all restart at once
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "0"))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", str(max_requests // 10)))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "30"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+
+# Create the tables and apply the schema migrations once, in the master
+# before any worker starts, instead of in every worker within its boot
+# timeout. Turn it off when "flask db-upgrade" runs as a release step.
+db_upgrade = os.getenv("GUNICORN_DB_UPGRADE", "true").lower() in ("1", "true", "yes")
+
+# Every worker writes its Prometheus metrics to files in this directory so
+# that /metrics can add up all of the workers. It has to be set before the
+# app is loaded. A directory made here is removed again in on_exit.
+metrics_dir = None
+if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+    metrics_dir = tempfile.mkdtemp(prefix="orders-metrics-")
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = metrics_dir
+
+
+def dispose_engine():
+    """Drops the pooled database connections if the app is already loaded"""
+    if "service.models" not in sys.modules:
+        return
+    from service import app  # pylint: disable=import-outside-toplevel
+    from service.models import db  # pylint: disable=import-outside-toplevel
+    with app.app_context():
+        db.engine.dispose()
+
+
+def upgrade_database():
+    """Runs "flask db-upgrade" and stops gunicorn if it fails"""
+    # in a process of its own: loading the app in the master would keep
+    # gevent from patching it in the workers, and would hold connections
+    env = dict(os.environ)
+    env.setdefault("FLASK_APP", "service:app")
+    result = subprocess.run([sys.executable, "-m", "flask", "db-upgrade"], env=env,
+                            check=False)
+    if result.returncode:
+        sys.exit(result.returncode)
+
+
+def on_starting(server):  # pylint: disable=unused-argument
+    """Runs in the master before anything else"""
+    if db_upgrade:
+        upgrade_database()
+    # drop the metrics of a previous run that used the same directory, or
+    # the files of its dead workers would add up across restarts
+    for path in glob.glob(os.path.join(os.environ["PROMETHEUS_MULTIPROC_DIR"], "*.db")):
+        os.remove(path)
+
+
+def pre_fork(server, worker):  # pylint: disable=unused-argument
+    """Runs in the master before each worker is forked"""
+    # with preload_app the master connected to the database while loading
+    # the app; close those connections so no worker inherits their sockets
+    dispose_engine()
+
+
+def post_fork(server, worker):  # pylint: disable=unused-argument
+    """Runs in each worker right after it is forked"""
+    # give the worker a pool of its own in case it inherited one anyway
+    dispose_engine()
+    if worker_class == "gevent":
+        # psycopg2 is a C extension that gevent can't patch, make it wait
+        # on its sockets through gevent instead of blocking the worker
+        from psycogreen.gevent import patch_psycopg  # pylint: disable=import-outside-toplevel
+        patch_psycopg()
+
+
+def child_exit(server, worker):  # pylint: disable=unused-argument
+    """Runs in the master when a worker exits"""
+    # stop counting the live gauges, such as the requests in progress, of
+    # the worker
+    from prometheus_client import multiprocess  # pylint: disable=import-outside-toplevel
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def on_exit(server):  # pylint: disable=unused-argument
+    """Runs in the master just before gunicorn exits"""
+    # after a USR2 upgrade the new master goes on with the directory
+    if metrics_dir is not None and not getattr(server, "reexec_pid", 0):
+        shutil.rmtree(metrics_dir, ignore_errors=True)
@@ -29,6 +29,13 @@ app.config.from_object("config")
 
 # Import the routes After the Flask app is created
 from service import routes, models # pylint: disable=wrong-import-position
+from service import commands, compression, metrics, profiling, querystats # pylint: disable=wrong-import-position
+
+commands.init_app(app)
+compression.init_app(app)
+querystats.init_app(app)
+metrics.init_app(app)
+profiling.init_app(app)
 
 # Set up logging for production
 print("Setting up logging for {}...".format(__name__))
@@ -51,7 +58,7 @@ app.logger.info("  O R D E R S   S E R V I C E  ".center(70, "*"))
 app.logger.info(70 * "*")
 
 try:
-    models.init_db(app)  # make our sqlalchemy tables
+    models.init_db(app)  # the tables are made by "flask db-upgrade"
 except Exception as error:  # pylint: disable=broad-except
     app.logger.critical("%s: Cannot continue", error)
     # gunicorn requires exit code 4 to stop spawning workers when they die
@@ -0,0 +1,236 @@
+# Copyright 2016, 2021 John Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Cache for the orders Service
+
+Cache - counts hits and misses in front of a pluggable backend
+
+Backends
+--------
+CacheBackend - the interface that every backend implements
+LRUCache - an in-process least recently used cache whose entries expire
+NullCache - a backend that never stores anything, to turn caching off
+
+The backend is picked with the ORDER_CACHE_BACKEND setting, which is
+either "lru", "null" or the dotted path of a CacheBackend subclass, e.g.
+"mypackage.caches:RedisCache". The class is created with the app config.
+
+The in-process backend is per worker and only the worker that wrote an
+order invalidates its entry, so the orders check the version of a cached
+entry against the database before using it (CustomerOrder.find_cached).
+"""
+import time
+import logging
+import importlib
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger("flask.app") # pylint: disable=invalid-name
+
+
+######################################################################
+#  B A C K E N D S
+######################################################################
+class CacheBackend:
+    """Interface of a cache backend"""
+
+    def get(self, key):
+        """Returns the value stored under a key, or None if there is none"""
+        raise NotImplementedError
+
+    def set(self, key, value):
+        """Stores a value under a key"""
+        raise NotImplementedError
+
+    def delete(self, key):
+        """Removes the value stored under a key, if there is one"""
+        raise NotImplementedError
+
+    def clear(self):
+        """Removes all of the values"""
+        raise NotImplementedError
+
+    def stats(self):
+        """Returns a dictionary of backend specific statistics"""
+        return {}
+
+
+class NullCache(CacheBackend):
+    """A backend that doesn't store anything"""
+
+    def __init__(self, config=None):
+        pass
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def clear(self):
+        pass
+
+
+class LRUCache(CacheBackend):
+    """An in-process least recently used cache with a time to live
+
+    :param maxsize: the most entries to keep before evicting the oldest
+    :type maxsize: int
+    :param ttl: the number of seconds an entry is valid for
+    :type ttl: float
+
+    """
+
+    def __init__(self, maxsize=1024, ttl=10.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        """Creates a cache from the ORDER_CACHE_SIZE and ORDER_CACHE_TTL settings"""
+        return cls(maxsize=config["ORDER_CACHE_SIZE"], ttl=config["ORDER_CACHE_TTL"])
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "evictions": self.evictions,
+        }
+
+
+######################################################################
+#  C A C H E
+######################################################################
+class Cache:
+    """Counts the hits and misses of a cache backend
+
+    :param backend: where the values are stored
+    :type backend: CacheBackend
+
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend or NullCache()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, is_current=None):
+        """Returns the value stored under a key, or None on a miss
+
+        :param key: the key of the value
+        :type key: hashable
+        :param is_current: tells whether a stored value is still up to date;
+                           one that isn't is removed and counted as a miss
+        :type is_current: callable
+
+        :return: the value, or None if there is none or it is out of date
+        :rtype: object
+
+        """
+        value = self.backend.get(key)
+        if value is not None and is_current is not None and not is_current(value):
+            logger.info("Cached value of %s is out of date", key)
+            self.backend.delete(key)
+            value = None
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key, value):
+        """Stores a value under a key"""
+        self.backend.set(key, value)
+
+    def invalidate(self, key):
+        """Removes the value stored under a key"""
+        self.backend.delete(key)
+
+    def clear(self):
+        """Removes all of the values and resets the counters"""
+        self.backend.clear()
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """Returns the hit and miss counters and the backend statistics"""
+        lookups = self.hits + self.misses
+        stats = {
+            "backend": type(self.backend).__name__,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+        stats.update(self.backend.stats())
+        return stats
+
+
+def make_backend(config):
+    """Creates the cache backend named by the ORDER_CACHE_BACKEND setting
+
+    :param config: the Flask app config
+    :type config: dict
+
+    :return: the cache backend
+    :rtype: CacheBackend
+
+    """
+    name = config.get("ORDER_CACHE_BACKEND", "lru")
+    logger.info("Using %s order cache", name)
+    if name == "lru":
+        return LRUCache.from_config(config)
+    if name == "null":
+        return NullCache()
+    module_name, _, class_name = name.partition(":")
+    backend_class = getattr(importlib.import_module(module_name), class_name)
+    return backend_class(config)
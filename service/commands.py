@@ -0,0 +1,40 @@
+# Copyright 2016, 2021 John Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Command line tasks of the orders Service
+
+    flask db-upgrade - creates the missing tables and applies the pending
+                       schema migrations, once per deploy before the
+                       workers start
+"""
+import click
+from flask.cli import with_appcontext
+from service.models import upgrade_db
+
+
+def init_app(app):
+    """Adds the commands to the flask command of the app"""
+    app.cli.add_command(db_upgrade)
+
+
+@click.command("db-upgrade")
+@with_appcontext
+def db_upgrade():
+    """Create the missing tables and apply the pending migrations"""
+    applied = upgrade_db()
+    if applied:
+        click.echo(f"Applied migrations {', '.join(str(version) for version in applied)}")
+    else:
+        click.echo("The database is up to date")
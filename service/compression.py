@@ -0,0 +1,111 @@
+# Copyright 2016, 2021 John Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Response compression for the orders Service
+
+Responses are compressed with brotli or gzip, whichever the client
+prefers, if their media type is one of COMPRESSION_MIMETYPES. Brotli is in
+the requirements; where the package is missing only gzip is offered.
+Buffered responses are only compressed from COMPRESSION_MIN_SIZE bytes up,
+smaller ones such as a single order go out as they are. Streamed responses can't be measured up front so they are
+always compressed, chunk by chunk, flushing after every chunk so that
+nothing is held back from the client.
+"""
+import gzip
+import zlib
+from flask import current_app, request
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None  # pylint: disable=invalid-name
+
+
+def init_app(app):
+    """Compresses the responses of the app"""
+    app.after_request(compress_response)
+
+
+def choose_encoding():
+    """Returns the content coding to use for the current request, or None
+
+    The client's q-values decide, brotli is preferred when they are equal
+    """
+    available = ["br", "gzip"] if brotli is not None else ["gzip"]
+    return request.accept_encodings.best_match(available)
+
+
+def compress_response(response):
+    """Compresses a response if the client accepts it and it is worth it"""
+    config = current_app.config
+    if (not config["COMPRESSION_ENABLED"]
+            or response.mimetype not in config["COMPRESSION_MIMETYPES"]
+            or response.direct_passthrough
+            or response.status_code < 200
+            or response.status_code in (204, 304)
+            or "Content-Encoding" in response.headers):
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = choose_encoding()
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        response.response = compress_stream(response.response, encoding, config)
+        response.headers.pop("Content-Length", None)
+    else:
+        data = response.get_data()
+        if len(data) < config["COMPRESSION_MIN_SIZE"]:
+            return response
+        response.set_data(compress(data, encoding, config))
+
+    response.headers["Content-Encoding"] = encoding
+    # the compressed bytes differ from the ones the strong ETag was made for
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def compress(data, encoding, config):
+    """Compresses a whole response body"""
+    if encoding == "br":
+        return brotli.compress(data, quality=config["COMPRESSION_BROTLI_LEVEL"])
+    return gzip.compress(data, compresslevel=config["COMPRESSION_GZIP_LEVEL"])
+
+
+def compress_stream(chunks, encoding, config):
+    """Compresses the chunks of a streamed response as they are produced
+
+    The chunks are closed however the stream ends, the client going away
+    included, since the cleanup of the response hangs off their close()
+    """
+    try:
+        if encoding == "br":
+            compressor = brotli.Compressor(quality=config["COMPRESSION_BROTLI_LEVEL"])
+            for chunk in chunks:
+                yield compressor.process(chunk) + compressor.flush()
+            yield compressor.finish()
+        else:
+            # wbits of 16 + MAX_WBITS writes a gzip header and trailer
+            compressor = zlib.compressobj(config["COMPRESSION_GZIP_LEVEL"], zlib.DEFLATED,
+                                          16 + zlib.MAX_WBITS)
+            for chunk in chunks:
+                yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            yield compressor.flush()
+    finally:
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            close()
@@ -0,0 +1,122 @@
+# Copyright 2016, 2021 John Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Prometheus metrics for the orders Service
+
+Every request is timed and counted by route, method and status code, along
+with the number of SQL statements it ran and the time they took, as counted
+by service.querystats. GET
+/metrics exports them with the statistics of the order cache and of the
+connection pool.
+
+When gunicorn runs several workers, gunicorn.conf.py points the
+PROMETHEUS_MULTIPROC_DIR environment variable at a directory where each
+worker writes its metrics, and /metrics adds up the files of all of the
+workers, whichever of them serves it.
+"""
+import os
+import time
+from flask import g, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Gauge, Histogram, REGISTRY, generate_latest,
+    multiprocess,
+)
+from service.models import CustomerOrder, db
+from service.pool import pool_stats
+
+REQUEST_LATENCY = Histogram(
+    "orders_http_request_duration_seconds",
+    "Time spent handling requests, the _count is the number of requests",
+    ["method", "route", "status"],
+)
+REQUESTS_IN_PROGRESS = Gauge(
+    "orders_http_requests_in_progress", "Requests being handled", multiprocess_mode="livesum"
+)
+REQUEST_QUERIES = Histogram(
+    "orders_db_queries_per_request", "SQL statements run by a request", ["route"],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, float("inf")),
+)
+REQUEST_DB_TIME = Histogram(
+    "orders_db_seconds_per_request", "Time a request spent running SQL statements", ["route"],
+)
+
+# statistics of the order cache and of the connection pool, set after
+# every request by the worker that handled it
+CACHE_GAUGES = {
+    name: Gauge(f"orders_cache_{name}", description, multiprocess_mode="livesum")
+    for name, description in (
+        ("hits", "Orders found in the cache since the worker started"),
+        ("misses", "Orders not found in the cache since the worker started"),
+        ("size", "Orders in the cache"),
+        ("evictions", "Orders evicted from the cache since the worker started"),
+    )
+}
+POOL_GAUGES = {
+    name: Gauge(f"orders_db_pool_{name}", description, multiprocess_mode="livesum")
+    for name, description in (
+        ("checked_out", "Database connections in use"),
+        ("overflow", "Database connections open beyond the pool size"),
+        ("checkouts", "Database connections checked out since the pool was created"),
+        ("timeouts", "Checkouts that gave up waiting for a connection"),
+        ("wait_time", "Seconds spent waiting for a connection since the pool was created"),
+    )
+}
+
+
+def init_app(app):
+    """Collects the metrics of the app and exports them on /metrics"""
+    app.before_request(start_timer)
+    app.after_request(record_request)
+    app.add_url_rule("/metrics", "metrics", metrics)
+
+
+def start_timer():
+    """Starts timing a request"""
+    REQUESTS_IN_PROGRESS.inc()
+    g.metrics_start = time.perf_counter()
+
+
+def record_request(response):
+    """Records the metrics of a request that is done"""
+    if "metrics_start" not in g:
+        return response
+    elapsed = time.perf_counter() - g.pop("metrics_start")
+    REQUESTS_IN_PROGRESS.dec()
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    REQUEST_LATENCY.labels(request.method, route, response.status_code).observe(elapsed)
+    if "query_stats" in g:
+        REQUEST_QUERIES.labels(route).observe(g.query_stats.count)
+        REQUEST_DB_TIME.labels(route).observe(g.query_stats.total)
+    update_resource_gauges()
+    return response
+
+
+def update_resource_gauges():
+    """Copies the statistics of the order cache and of the pool to the gauges"""
+    for stats, gauges in ((CustomerOrder.cache.stats(), CACHE_GAUGES),
+                          (pool_stats(db.engine.pool), POOL_GAUGES)):
+        for name, gauge in gauges.items():
+            if name in stats:
+                gauge.set(stats[name])
+
+
+def metrics():
+    """Exports the metrics of every worker in the Prometheus text format"""
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), 200, {"Content-Type": CONTENT_TYPE_LATEST}
@@ -0,0 +1,263 @@
+# Copyright 2016, 2021 John Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Schema migrations for the orders Service
+
+db.create_all() only creates the tables that are missing, so it never
+changes a table that already exists in a production database. Changes to
+existing tables (new indexes, new columns) are made by the migrations in
+this module instead.
+
+Every migration is a function that takes the engine and runs once, in
+order of its version number. Applied versions are recorded in the
+schema_version table. Migrations must be safe to run against a database
+that db.create_all() has just built, since a new database already has the
+latest schema.
+
+upgrade() creates the missing tables and applies the migrations. It is an
+explicit step, run by "flask db-upgrade" or by the gunicorn master before
+it starts any worker, never while the app is imported: a migration may
+take far longer than a worker is given to boot. Several instances can
+still start at once, so the upgrade runs under a lock: an advisory lock on
+PostgreSQL and a file lock next to the database on SQLite. The first
+process applies the migrations while the others wait, and then find
+nothing left to do.
+"""
+import time
+import fcntl
+import logging
+from contextlib import contextmanager
+from datetime import datetime
+from sqlalchemy import MetaData, Table, Column, Integer, String, DateTime, inspect, text
+from sqlalchemy.exc import IntegrityError
+
+logger = logging.getLogger("flask.app") # pylint: disable=invalid-name
+
+metadata = MetaData() # pylint: disable=invalid-name
+
+# key of the PostgreSQL advisory lock held while migrating, any constant
+# that no other lock of the database uses
+MIGRATION_LOCK = 0x6F72646572
+# seconds between attempts to take the lock
+MIGRATION_LOCK_POLL = 0.2
+
+schema_version = Table( # pylint: disable=invalid-name
+    "schema_version",
+    metadata,
+    Column("version", Integer, primary_key=True, autoincrement=False),
+    Column("description", String(256), nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+
+######################################################################
+#  H E L P E R S
+######################################################################
+def create_index(engine, name, table, columns):
+    """Creates an index if it does not exist yet
+
+    On PostgreSQL the index is built CONCURRENTLY so that a live table is
+    not locked against writes while the index is being built.
+
+    :param engine: the engine of the database to change
+    :type engine: Engine
+    :param name: the name of the index
+    :type name: str
+    :param table: the name of the table to index
+    :type table: str
+    :param columns: the names of the columns to index
+    :type columns: list
+
+    """
+    logger.info("Creating index %s on %s", name, table)
+    columns = ", ".join(columns)
+    if engine.dialect.name == "postgresql":
+        # CREATE INDEX CONCURRENTLY can't run inside a transaction
+        with engine.connect() as connection:
+            connection.execution_options(isolation_level="AUTOCOMMIT").execute(
+                text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} ({columns})")
+            )
+    else:
+        engine.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})"))
+
+
+def add_column(engine, table, column, definition):
+    """Adds a column to a table if it does not have it yet
+
+    :param engine: the engine of the database to change
+    :type engine: Engine
+    :param table: the name of the table to change
+    :type table: str
+    :param column: the name of the new column
+    :type column: str
+    :param definition: the SQL type and constraints of the column
+    :type definition: str
+
+    """
+    if column in {col["name"] for col in inspect(engine).get_columns(table)}:
+        return
+    logger.info("Adding column %s to %s", column, table)
+    # SQLite has no IF NOT EXISTS for columns
+    exists = " IF NOT EXISTS" if engine.dialect.name == "postgresql" else ""
+    engine.execute(text(f"ALTER TABLE {table} ADD COLUMN{exists} {column} {definition}"))
+
+
+######################################################################
+#  M I G R A T I O N S
+######################################################################
+def index_order_lookups(engine):
+    """Indexes the columns that orders are looked up by"""
+    create_index(engine, "ix_customer_order_customer_id", "customer_order", ["customer_id"])
+    create_index(engine, "ix_item_item_name", "item", ["item_name"])
+    create_index(engine, "ix_item_order_id_id", "item", ["order_id", "id"])
+
+
+def add_order_version(engine):
+    """Adds the version of every order, used as its ETag"""
+    add_column(engine, "customer_order", "version", "INTEGER NOT NULL DEFAULT 1")
+
+
+def add_order_totals(engine):
+    """Adds the item count and total price of every order"""
+    add_column(engine, "customer_order", "item_count", "INTEGER NOT NULL DEFAULT 0")
+    add_column(engine, "customer_order", "total_price", "FLOAT NOT NULL DEFAULT 0")
+    # a single pass over the items of every order, a NULL quantity counts as
+    # 1 and the totals are kept to the cent like the model does
+    engine.execute(text(
+        "UPDATE customer_order SET "
+        "item_count = (SELECT COUNT(*) FROM item WHERE item.order_id = customer_order.id), "
+        "total_price = (SELECT ROUND(CAST(COALESCE(SUM(item.price * COALESCE(item.quantity, 1)), "
+        "0) AS NUMERIC), 2) FROM item WHERE item.order_id = customer_order.id)"
+    ))
+    create_index(engine, "ix_customer_order_total_price_id", "customer_order",
+                 ["total_price", "id"])
+
+
+def index_order_search(engine):
+    """Indexes the status and address of the orders for searches"""
+    create_index(engine, "ix_customer_order_status_id", "customer_order", ["status", "id"])
+    address = "address"
+    if engine.dialect.name == "postgresql":
+        # LIKE 'prefix%' can only use an index with the pattern operators
+        address = "address varchar_pattern_ops"
+    create_index(engine, "ix_customer_order_address", "customer_order", [address])
+
+
+# (version, migration) in the order they must be applied
+MIGRATIONS = [
+    (1, index_order_lookups),
+    (2, add_order_version),
+    (3, add_order_totals),
+    (4, index_order_search),
+]
+
+
+######################################################################
+#  R U N N E R
+######################################################################
+def current_version(engine):
+    """Returns the latest migration version applied to the database"""
+    metadata.create_all(engine, tables=[schema_version])
+    version = engine.execute(
+        text("SELECT MAX(version) FROM schema_version")
+    ).scalar()
+    return version or 0
+
+
+@contextmanager
+def migration_lock(engine):
+    """Keeps other processes from migrating the database at the same time
+
+    On PostgreSQL a session advisory lock is taken on a connection of its
+    own, outside of any transaction. The waiting processes poll for it
+    rather than block in pg_advisory_lock(): CREATE INDEX CONCURRENTLY
+    waits for every transaction older than itself to finish, a blocked
+    statement included, which would deadlock with the lock holder.
+
+    A SQLite database file is locked through a file of its own next to it,
+    since a lock on the database itself would also keep the migrations
+    from writing. An in-memory database belongs to a single process.
+
+    :param engine: the engine of the database to lock
+    :type engine: Engine
+
+    """
+    if engine.dialect.name == "sqlite":
+        database = engine.url.database
+        if not database or database == ":memory:":
+            yield
+            return
+        with open(f"{database}.migration-lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+        return
+    if engine.dialect.name != "postgresql":
+        yield
+        return
+    with engine.connect() as connection:
+        connection = connection.execution_options(isolation_level="AUTOCOMMIT")
+        while not connection.execute(text("SELECT pg_try_advisory_lock(:key)"),
+                                     key=MIGRATION_LOCK).scalar():
+            logger.info("Waiting for another process to migrate the database")
+            time.sleep(MIGRATION_LOCK_POLL)
+        try:
+            yield
+        finally:
+            connection.execute(text("SELECT pg_advisory_unlock(:key)"), key=MIGRATION_LOCK)
+
+
+def upgrade(engine, tables=None):
+    """Creates the missing tables and applies the migrations the database is missing
+
+    :param engine: the engine of the database to upgrade
+    :type engine: Engine
+    :param tables: the tables of the models, created first if missing
+    :type tables: MetaData
+
+    :return: the versions of the migrations that were applied
+    :rtype: list
+
+    """
+    with migration_lock(engine):
+        if tables is not None:
+            tables.create_all(engine)
+        # read the version once the lock is held, the process that held it
+        # before may have applied everything
+        return _apply(engine, current_version(engine))
+
+
+def _apply(engine, version):
+    """Applies the migrations after version, the lock being held"""
+    applied = []
+    for migration_version, migration in MIGRATIONS:
+        if migration_version <= version:
+            continue
+        logger.info("Applying migration %s: %s", migration_version, migration.__doc__)
+        migration(engine)
+        try:
+            engine.execute(schema_version.insert().values(
+                version=migration_version,
+                description=migration.__doc__,
+                applied_at=datetime.utcnow(),
+            ))
+        except IntegrityError:
+            # a database without the lock, migrated by two processes at once
+            logger.info("Migration %s was already recorded", migration_version)
+        applied.append(migration_version)
+    logger.info("Database schema is at version %s", MIGRATIONS[-1][0])
+    return applied
@@ -27,6 +27,10 @@ CustomerOrder - An order object containing all the items in a customer order.
     address (string) - the shipping address of the order
     items (relationship) - collections of items that are inside the order
     status (enum) - the status of the order (received, processing, cancelled, etc.)
+    version (integer) - goes up on every change to the order or its items
+    item_count (integer) - the number of items in the order
+    total_price (float) - the price of all of the items, times their quantity,
+                          to the cent
 
 Item - An item object represents the product in an order.
 
@@ -37,21 +41,85 @@ Item - An item object represents the product in an order.
     price (float) - the price of the product
     item_name (integer) - the name of the product
 """
+import re
 import logging
 from enum import Enum
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import and_, cast, distinct, event, func, text, tuple_
+from sqlalchemy.orm import selectinload
+from service import migrations
+from service.cache import Cache, make_backend
+from service.pool import engine_options
 
 logger = logging.getLogger("flask.app") # pylint: disable=invalid-name
 
 # Create the SQLAlchemy object to be initialized later in init_db()
 db = SQLAlchemy() # pylint: disable=invalid-name
 
+# the order totals are rounded to the cent on every write, so that adding
+# and removing the same items brings them back to exactly where they were
+TOTAL_PLACES = 2
+
 
 def init_db(app):
     """Initialies the SQLAlchemy app"""
     CustomerOrder.init_db(app)
 
 
+def upgrade_db():
+    """Creates the missing tables and brings the existing ones up to date
+
+    Run once per deploy by "flask db-upgrade" or the gunicorn master, not
+    by every worker as it starts
+
+    :return: the versions of the migrations that were applied
+    :rtype: list
+
+    """
+    return migrations.upgrade(db.engine, db.metadata)
+
+
+def bulk_insert(table, rows, return_ids=True):
+    """Inserts rows into a table with multi-row INSERT statements
+
+    The rows are added to the current transaction, the caller is
+    responsible for committing it.
+
+    :param table: the table to insert into
+    :type table: Table
+    :param rows: a dictionary of column values for every row
+    :type rows: list
+    :param return_ids: whether the ids of the new rows are needed
+    :type return_ids: bool
+
+    :return: the ids of the new rows in the same order, if asked for
+    :rtype: list
+
+    """
+    if not rows:
+        return []
+    ids = None
+    if return_ids:
+        if db.engine.dialect.name != "postgresql":
+            # without a sequence to draw ids from the ids are only known
+            # by inserting the rows one at a time
+            return [db.session.execute(table.insert(), row).inserted_primary_key[0]
+                    for row in rows]
+        # reserve the ids up front so a multi-row INSERT can still be used
+        ids = [row[0] for row in db.session.execute(
+            text("SELECT nextval(pg_get_serial_sequence(:table, 'id')) "
+                 "FROM generate_series(1, :count)"),
+            {"table": table.name, "count": len(rows)}
+        )]
+        rows = [dict(row, id=row_id) for row, row_id in zip(rows, ids)]
+    # stay under the limit on bound parameters in a single statement
+    max_parameters = 999 if db.engine.dialect.name == "sqlite" else 32767
+    chunk_size = max(1, max_parameters // len(rows[0]))
+    for start in range(0, len(rows), chunk_size):
+        db.session.execute(table.insert().values(rows[start:start + chunk_size]))
+    return ids
+
+
 class DataValidationError(Exception):
     """Used for an data validation errors when deserializing"""
 
@@ -82,7 +150,13 @@ class Item(db.Model):
     quantity = db.Column(db.Integer, nullable=True)
     price = db.Column(db.Float, nullable=False)
     # e.g., ball, balloon, etc.
-    item_name = db.Column(db.String(120), nullable=False)
+    item_name = db.Column(db.String(120), nullable=False, index=True)
+
+    # Indexes that are added to existing databases by service.migrations
+    __table_args__ = (
+        # covers the order_id foreign key and keeps an order's items in id order
+        db.Index("ix_item_order_id_id", "order_id", "id"),
+    )
 
     def __eq__(self, other):
         return (self.id == other.id) or ((self.id is None or other.id is None) and
@@ -91,6 +165,11 @@ class Item(db.Model):
                                          (self.quantity == other.quantity) and
                                          (self.price == other.price))
 
+    @property
+    def subtotal(self):
+        """The price of the item times its quantity"""
+        return self.price * (1 if self.quantity is None else self.quantity)
+
     @classmethod
     def find(cls, item_id):
         """Finds an item by its ID
@@ -105,11 +184,105 @@ class Item(db.Model):
         logger.info("Processing lookup for id %s ...", item_id)
         return cls.query.get(item_id)
 
+    @classmethod
+    def find_in_order(cls, order_id, item_id):
+        """Finds an item by its id within an order with a single query
+
+        The order is outer joined to the item so that a missing order can be
+        told apart from a missing item, without loading the order itself
+
+        :param order_id: the id of the order the item must belong to
+        :type order_id: int
+        :param item_id: the id of the item to find
+        :type item_id: int
+
+        :return: whether the order exists, and the item or None if it is
+                 not in the order
+        :rtype: tuple
+
+        """
+        logger.info("Processing lookup for item %s in order %s ...", item_id, order_id)
+        row = db.session.query(CustomerOrder.id, cls).outerjoin(
+            cls, and_(cls.order_id == CustomerOrder.id, cls.id == item_id)
+        ).filter(CustomerOrder.id == order_id).first()
+        if row is None:
+            return False, None
+        return True, row[1]
+
+    def create(self):
+        """
+        Creates an Item in the database
+
+        The item is inserted by its order_id, the order and its other
+        items are not loaded
+        """
+        logger.info("Creating item for order %s", self.order_id)
+        # id must be none to generate next primary key
+        self.id = None  # pylint: disable=invalid-name
+        db.session.add(self)
+        CustomerOrder.touch(self.order_id, 1, self.subtotal)
+        db.session.commit()
+        CustomerOrder.cache.invalidate(self.order_id)
+
+    @classmethod
+    def create_many(cls, order_id, items):
+        """Adds a batch of Items to an order in a single transaction
+
+        :param order_id: the id of the order to add the items to
+        :type order_id: int
+        :param items: the items to add
+        :type items: list
+
+        :return: the ids of the new items in the same order
+        :rtype: list
+
+        """
+        logger.info("Adding %d items to order %s", len(items), order_id)
+        try:
+            ids = bulk_insert(cls.__table__, [
+                {"order_id": order_id,
+                 "quantity": item.quantity,
+                 "price": item.price,
+                 "item_name": item.item_name}
+                for item in items
+            ])
+            CustomerOrder.touch(order_id, len(items), sum(item.subtotal for item in items))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        CustomerOrder.cache.invalidate(order_id)
+        for item, item_id in zip(items, ids):
+            item.id = item_id
+            item.order_id = order_id
+            # as the column reads it back, so that a price of 3 is 3.0
+            item.price = float(item.price)
+        return ids
+
     def delete(self):
-        """Removes an item from the data store"""
+        """Removes an item from the data store
+
+        The row is deleted by a DELETE of its own rather than through the
+        session, so that when two requests delete the same item only the
+        one whose DELETE removed the row takes it off the order's totals
+
+        :return: whether the item was deleted by this call
+        :rtype: bool
+
+        """
         logger.info("Deleting order %s", self.id)
-        db.session.delete(self)
-        db.session.commit()
+        order_id = self.order_id
+        try:
+            deleted = Item.query.filter_by(id=self.id, order_id=order_id).delete(
+                synchronize_session="evaluate")
+            if deleted:
+                CustomerOrder.touch(order_id, -1, -self.subtotal)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        CustomerOrder.cache.invalidate(order_id)
+        return deleted == 1
 
     def serialize(self):
         """ Serializes a Address into a dictionary """
@@ -150,18 +323,39 @@ class CustomerOrder(db.Model):
     """
 
     app = None
+    # the orders that keyset_page() can sort by
+    SORTS = ("id", "total_price", "-total_price")
+    # serialized orders by id, set up by init_db()
+    cache = Cache()
 
     ##################################################
     # Table Schema
     ##################################################
     id = db.Column(db.Integer, primary_key=True)
-    customer_id = db.Column(db.Integer, nullable=False)
+    customer_id = db.Column(db.Integer, nullable=False, index=True)
     address = db.Column(db.String(256), nullable=False)
     items = db.relationship('Item', backref='order',
                             lazy=True, cascade="all, delete")
     status = db.Column(
         db.Enum(Status), nullable=False, server_default=(Status.Received.name)
     )
+    version = db.Column(db.Integer, nullable=False, default=1, server_default="1")
+    # kept up to date by every write of the items, so that orders can be
+    # filtered and sorted by them without reading the items
+    item_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    total_price = db.Column(db.Float, nullable=False, default=0.0, server_default="0")
+
+    # Indexes that are added to existing databases by service.migrations
+    __table_args__ = (
+        # filters on the total and keyset pages sorted by it
+        db.Index("ix_customer_order_total_price_id", "total_price", "id"),
+        # filters on the status, in id order for keyset pages
+        db.Index("ix_customer_order_status_id", "status", "id"),
+        # address prefixes, Postgres only uses an index for LIKE 'prefix%'
+        # with the pattern operators when the collation isn't C
+        db.Index("ix_customer_order_address", "address",
+                 postgresql_ops={"address": "varchar_pattern_ops"}),
+    )
 
     ##################################################
     # INSTANCE METHODS
@@ -178,6 +372,8 @@ class CustomerOrder(db.Model):
         logger.info("Creating order %s", self.id)
         # id must be none to generate next primary key
         self.id = None  # pylint: disable=invalid-name
+        self.item_count = len(self.items)
+        self.total_price = round(sum(item.subtotal for item in self.items), TOTAL_PLACES)
         db.session.add(self)
         db.session.commit()
 
@@ -188,14 +384,17 @@ class CustomerOrder(db.Model):
         logger.info("Updating order %s", self.id)
         if not self.id:
             raise DataValidationError("Update called with empty ID field")
-        
+        self.version = CustomerOrder.version + 1
         db.session.commit()
+        self.cache.invalidate(self.id)
 
     def delete(self):
         """Removes a order from the data store"""
         logger.info("Deleting order %s", self.id)
+        order_id = self.id
         db.session.delete(self)
         db.session.commit()
+        self.cache.invalidate(order_id)
 
     def serialize(self):
         """Serializes a order into a dictionary"""
@@ -205,6 +404,9 @@ class CustomerOrder(db.Model):
             "address": self.address,
             "items": [],
             "status": self.status.name,  # convert enum to string
+            "version": self.version,
+            "item_count": self.item_count,
+            "total_price": self.total_price,
         }
         for item in self.items:
             order["items"].append(item.serialize())
@@ -228,6 +430,9 @@ class CustomerOrder(db.Model):
         except KeyError as error:
             raise DataValidationError(
                 "Invalid order: missing " + error.args[0])
+        except AttributeError:
+            raise DataValidationError(
+                "Invalid order: unknown status " + str(data["status"]))
         except TypeError as error:
             raise DataValidationError(
                 "Invalid order: body of request contained bad or no data"
@@ -248,16 +453,17 @@ class CustomerOrder(db.Model):
         """
         logger.info("Initializing database")
         cls.app = app
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(app.config)
         # This is where we initialize SQLAlchemy from the Flask app
         db.init_app(app)
+        cls.cache = Cache(make_backend(app.config))
         app.app_context().push()
-        db.create_all()  # make our sqlalchemy tables
 
     @classmethod
     def all(cls):
         """Returns all of the orders in the database"""
         logger.info("Processing all orders")
-        return cls.query.all()
+        return cls.query.options(selectinload(cls.items)).all()
 
     @classmethod
     def find(cls, customer_order_id):
@@ -271,7 +477,200 @@ class CustomerOrder(db.Model):
 
         """
         logger.info("Processing lookup for id %s ...", customer_order_id)
-        return cls.query.get(customer_order_id)
+        return cls.query.options(selectinload(cls.items)).get(customer_order_id)
+
+    @classmethod
+    def find_serialized(cls, customer_order_id):
+        """Finds a serialized order by it's ID, from the cache when possible
+
+        The dictionary may be shared with the cache so it must not be changed.
+        A cached order is only used while its version is the current one, see
+        find_cached.
+
+        :param customer_order_id: the id of the order to find
+        :type customer_order_id: int
+
+        :return: the serialized order, or None if not found
+        :rtype: dict
+
+        """
+        order = cls.find_cached(customer_order_id)
+        if order is None:
+            customer_order = cls.find(customer_order_id)
+            if not customer_order:
+                return None
+            order = customer_order.serialize()
+            cls.cache.set(customer_order_id, order)
+        return order
+
+    @classmethod
+    def find_cached(cls, customer_order_id):
+        """Finds a serialized order in the cache if it is still up to date
+
+        Only the process that wrote an order invalidates its entry, and a
+        reader can put back an order it read just before a write, so an entry
+        is checked against the version in the database before it is used,
+        and counted as a miss when it is out of date. That lookup is a single
+        row of the primary key index, much cheaper than loading and
+        serializing the order with its items.
+
+        :param customer_order_id: the id of the order to find
+        :type customer_order_id: int
+
+        :return: the serialized order, or None if not cached or out of date
+        :rtype: dict
+
+        """
+        return cls.cache.get(
+            customer_order_id,
+            lambda order: order["version"] == cls.find_version(customer_order_id),
+        )
+
+    @classmethod
+    def cancel(cls, customer_order_id):
+        """Cancels a CustomerOrder unless it is Completed or Returned
+
+        The status is checked and changed by a single conditional UPDATE,
+        so two requests racing on the same order can't both act on a stale
+        status. The order is only read again when the UPDATE matched
+        nothing, to tell a missing order from one that can't be cancelled.
+        On Postgres the UPDATE returns the cancelled order with its items,
+        so a successful cancel is a single round trip.
+
+        :param customer_order_id: the id of the order to cancel
+        :type customer_order_id: int
+
+        :return: the status of the order after the attempt, or None if not
+                 found, and the serialized order when it was cancelled and
+                 is still there
+        :rtype: tuple
+
+        """
+        logger.info("Cancelling order %s", customer_order_id)
+        table = cls.__table__
+        update = (
+            table.update()
+            .where(table.c.id == customer_order_id)
+            .where(table.c.status.notin_([Status.Completed, Status.Returned]))
+            .values(status=Status.Cancelled, version=table.c.version + 1)
+        )
+        order = None
+        try:
+            if db.engine.dialect.name == "postgresql":
+                order = cls._serialize_rows(db.session.execute(
+                    cls._with_items(update.returning(*table.c).cte("cancelled"))
+                ).fetchall())
+                cancelled = order is not None
+            else:
+                cancelled = db.session.execute(update).rowcount > 0
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        if cancelled:
+            cls.cache.invalidate(customer_order_id)
+            return Status.Cancelled, order or cls.find_serialized(customer_order_id)
+        status = db.session.query(cls.status).filter(cls.id == customer_order_id).scalar()
+        return status, None
+
+    @staticmethod
+    def _with_items(orders):
+        """Selects the rows of some orders joined with their items, if any"""
+        items = Item.__table__
+        return (
+            db.select([orders, items.c.id.label("item_id"), items.c.quantity,
+                       items.c.price, items.c.item_name])
+            .select_from(orders.outerjoin(items, items.c.order_id == orders.c.id))
+            .order_by(items.c.id)
+        )
+
+    @staticmethod
+    def _serialize_rows(rows):
+        """Serializes an order from its rows joined with its items, like serialize()"""
+        if not rows:
+            return None
+        row = rows[0]
+        return {
+            "id": row.id,
+            "customer_id": row.customer_id,
+            "address": row.address,
+            "items": [
+                {
+                    "item_id": row.item_id,
+                    "order_id": row.id,
+                    "quantity": row.quantity,
+                    "price": row.price,
+                    "item_name": row.item_name,
+                }
+                for row in rows if row.item_id is not None
+            ],
+            "status": row.status.name,
+            "version": row.version,
+            "item_count": row.item_count,
+            "total_price": row.total_price,
+        }
+
+    @classmethod
+    def find_version(cls, customer_order_id):
+        """Finds the version of an order without loading the order
+
+        It is always read from the database, never from the cache, since it
+        is what tells whether a cached copy or an ETag is still current.
+
+        :param customer_order_id: the id of the order
+        :type customer_order_id: int
+
+        :return: the version of the order, or None if not found
+        :rtype: int
+
+        """
+        logger.info("Processing version lookup for id %s ...", customer_order_id)
+        return db.session.query(cls.version).filter(cls.id == customer_order_id).scalar()
+
+    @classmethod
+    def touch(cls, customer_order_id, items=0, total=0.0):
+        """Bumps the version of an order whose items changed
+
+        The item count and total price are changed by the same UPDATE. They
+        are incremented in SQL rather than recomputed from the items, so
+        writes of two transactions racing on the same order both count. The
+        total is rounded to TOTAL_PLACES so that floating point errors
+        don't add up.
+        The update is added to the current transaction, the caller is
+        responsible for committing it.
+
+        :param customer_order_id: the id of the order
+        :type customer_order_id: int
+        :param items: the number of items added, negative when removed
+        :type items: int
+        :param total: the price of the items added, negative when removed
+        :type total: float
+
+        """
+        values = {cls.version: cls.version + 1}
+        if items:
+            values[cls.item_count] = cls.item_count + items
+            # Postgres only rounds numerics, not floats
+            values[cls.total_price] = func.round(
+                cast(cls.total_price + total, db.Numeric), TOTAL_PLACES)
+        cls.query.filter(cls.id == customer_order_id).update(
+            values, synchronize_session=False)
+
+    @classmethod
+    def exists(cls, customer_order_id):
+        """Checks if a CustomerOrder exists without loading it
+
+        :param customer_order_id: the id of the CustomerOrder to look for
+        :type customer_order_id: int
+
+        :return: True if there is an order with the id
+        :rtype: bool
+
+        """
+        logger.info("Processing exists check for id %s ...", customer_order_id)
+        return db.session.query(
+            cls.query.filter(cls.id == customer_order_id).exists()
+        ).scalar()
 
     @classmethod
     def find_or_404(cls, customer_order_id):
@@ -286,14 +685,54 @@ class CustomerOrder(db.Model):
         """
         logger.info("Processing lookup or 404 for id %s ...",
                     customer_order_id)
-        return cls.query.get_or_404(customer_order_id)
+        return cls.query.options(selectinload(cls.items)).get_or_404(customer_order_id)
+
+    @classmethod
+    def create_many(cls, orders):
+        """Creates a batch of CustomerOrders and their items
+
+        All of the orders and items are inserted with multi-row INSERTs
+        in a single transaction, so either all of them are created or none
+
+        :param orders: the orders to create, with their items attached
+        :type orders: list
+
+        :return: the ids of the new orders in the same order
+        :rtype: list
+
+        """
+        logger.info("Creating %d orders", len(orders))
+        try:
+            ids = bulk_insert(cls.__table__, [
+                {"customer_id": order.customer_id,
+                 "address": order.address,
+                 "status": order.status,
+                 "item_count": len(order.items),
+                 "total_price": round(sum(item.subtotal for item in order.items),
+                                      TOTAL_PLACES)}
+                for order in orders
+            ])
+            bulk_insert(Item.__table__, [
+                {"order_id": order_id,
+                 "quantity": item.quantity,
+                 "price": item.price,
+                 "item_name": item.item_name}
+                for order, order_id in zip(orders, ids) for item in order.items
+            ], return_ids=False)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return ids
 
     def save(self):
         """
         Updates a order into the database
         """
         logger.info("Saving %s", self.id)
+        self.version = CustomerOrder.version + 1
         db.session.commit()
+        self.cache.invalidate(self.id)
 
     @classmethod
     def find_by_customer_id(cls, customer_id):
@@ -307,7 +746,8 @@ class CustomerOrder(db.Model):
 
         """
         logger.info("Processing customer_id query for %s ...", customer_id)
-        return cls.query.filter(cls.customer_id == customer_id)
+        return cls.query.options(selectinload(cls.items)).filter(
+            cls.customer_id == customer_id)
 
     @classmethod
     def find_by_including_item(cls, item_name):
@@ -321,7 +761,266 @@ class CustomerOrder(db.Model):
 
         """
         logger.info("Processing including item query for %s ...", item_name)
-        return cls.query.filter(cls.items.any(Item.item_name == item_name))
+        return cls.filter_by_item(cls.query.options(selectinload(cls.items)), item_name)
+
+    @classmethod
+    def search(cls, customer_id=None, item=None, statuses=None,  # pylint: disable=too-many-arguments
+               address=None, min_total=None, max_total=None):
+        """Returns the orders that match every criteria that is given
+
+        The criteria are combined into a single query, each with a condition
+        that an index can serve, and any of them can be left out. Page
+        through it with keyset_page() to sort it.
+
+        :param customer_id: the id of the customer of the orders
+        :type customer_id: int
+        :param item: the name of an item the orders must include
+        :type item: str
+        :param statuses: the statuses the orders may have
+        :type statuses: list
+        :param address: the start of the address of the orders
+        :type address: str
+        :param min_total: the lowest total price of the orders
+        :type min_total: float
+        :param max_total: the highest total price of the orders
+        :type max_total: float
+
+        :return: a query of the matching orders
+        :rtype: BaseQuery
+
+        """
+        logger.info("Processing search for customer %s, item %s, statuses %s, address %s, "
+                    "total %s to %s ...", customer_id, item, statuses, address,
+                    min_total, max_total)
+        query = cls.query
+        if customer_id is not None:
+            query = query.filter(cls.customer_id == customer_id)
+        if item is not None:
+            query = cls.filter_by_item(query, item)
+        if statuses:
+            query = cls.filter_by_status(query, statuses)
+        if address:
+            query = cls.filter_by_address_prefix(query, address)
+        return cls.filter_by_total(query, min_total, max_total)
+
+    @classmethod
+    def filter_by_item(cls, query, item_name):
+        """Narrows a query of orders down to the ones that include an item
+
+        :param query: the query of orders to filter
+        :type query: BaseQuery
+        :param item_name: the name of the item
+        :type item_name: str
+
+        :return: the filtered query
+        :rtype: BaseQuery
+
+        """
+        # an IN over the indexed item names, rather than a correlated EXISTS
+        # that has to be checked for every order
+        order_ids = db.session.query(Item.order_id).filter(Item.item_name == item_name)
+        return query.filter(cls.id.in_(order_ids))
+
+    @classmethod
+    def filter_by_address_prefix(cls, query, prefix):
+        """Narrows a query of orders down to the ones with an address that starts with prefix
+
+        :param query: the query of orders to filter
+        :type query: BaseQuery
+        :param prefix: the start of the address, matched case sensitively
+        :type prefix: str
+
+        :return: the filtered query
+        :rtype: BaseQuery
+
+        """
+        if db.engine.dialect.name == "sqlite":
+            # LIKE is case insensitive in SQLite and can't use the index,
+            # GLOB can. Its wildcards are matched literally inside brackets
+            pattern = re.sub(r"([*?[])", r"[\1]", prefix) + "*"
+            return query.filter(cls.address.op("GLOB")(pattern))
+        return query.filter(cls.address.startswith(prefix, autoescape=True))
+
+    @classmethod
+    def filter_by_total(cls, query, min_total=None, max_total=None):
+        """Narrows a query of orders down to the ones with a total in a range
+
+        :param query: the query of orders to filter
+        :type query: BaseQuery
+        :param min_total: the lowest total price to keep, if any
+        :type min_total: float
+        :param max_total: the highest total price to keep, if any
+        :type max_total: float
+
+        :return: the filtered query
+        :rtype: BaseQuery
+
+        """
+        if min_total is not None:
+            query = query.filter(cls.total_price >= min_total)
+        if max_total is not None:
+            query = query.filter(cls.total_price <= max_total)
+        return query
+
+    @classmethod
+    def filter_by_status(cls, query, statuses):
+        """Narrows a query of orders down to the ones in any of the statuses
+
+        :param query: the query of orders to filter
+        :type query: BaseQuery
+        :param statuses: the statuses to keep
+        :type statuses: list
+
+        :return: the filtered query
+        :rtype: BaseQuery
+
+        """
+        return query.filter(cls.status.in_(statuses))
+
+    ##################################################
+    # REPORTS
+    ##################################################
+
+    @classmethod
+    def report_by_status(cls, query, limit=None):  # pylint: disable=unused-argument
+        """Counts the orders of a query and adds up their totals by status
+
+        The totals are read from the orders, the items are not scanned
+
+        :param query: the query of the orders to report on
+        :type query: BaseQuery
+        :param limit: not used, there is a group for every status at most
+        :type limit: int
+
+        :return: the key, orders, items and revenue of every group
+        :rtype: list
+
+        """
+        logger.info("Processing order report by status ...")
+        rows = query.with_entities(
+            cls.status, func.count(cls.id), func.sum(cls.item_count), func.sum(cls.total_price)
+        ).group_by(cls.status).all()
+        return [{"key": row[0].name, "orders": row[1], "items": row[2], "revenue": row[3]}
+                for row in sorted(rows, key=lambda row: row[0].value)]
+
+    @classmethod
+    def report_by_customer(cls, query, limit=None):
+        """Counts the orders of a query and adds up their totals by customer
+
+        :param query: the query of the orders to report on
+        :type query: BaseQuery
+        :param limit: the number of customers with the most revenue to keep
+        :type limit: int
+
+        :return: the key, orders, items and revenue of every group
+        :rtype: list
+
+        """
+        logger.info("Processing order report by customer ...")
+        revenue = func.sum(cls.total_price)
+        rows = query.with_entities(
+            cls.customer_id, func.count(cls.id), func.sum(cls.item_count), revenue
+        ).group_by(cls.customer_id).order_by(revenue.desc(), cls.customer_id).limit(limit)
+        return [{"key": row[0], "orders": row[1], "items": row[2], "revenue": row[3]}
+                for row in rows]
+
+    @classmethod
+    def report_by_item(cls, query, limit=None):
+        """Counts the orders with every item of a query's orders and adds up its sales
+
+        A NULL quantity counts as 1
+
+        :param query: the query of the orders to report on
+        :type query: BaseQuery
+        :param limit: the number of item names with the most revenue to keep
+        :type limit: int
+
+        :return: the key, orders, items and revenue of every group
+        :rtype: list
+
+        """
+        logger.info("Processing order report by item ...")
+        revenue = func.sum(Item.price * func.coalesce(Item.quantity, 1))
+        rows = db.session.query(
+            Item.item_name, func.count(distinct(Item.order_id)), func.count(Item.id), revenue
+        )
+        if query.whereclause is not None:
+            rows = rows.filter(Item.order_id.in_(query.with_entities(cls.id)))
+        rows = rows.group_by(Item.item_name).order_by(revenue.desc(), Item.item_name).limit(limit)
+        return [{"key": row[0], "orders": row[1], "items": row[2], "revenue": row[3]}
+                for row in rows]
+
+    @classmethod
+    def keyset_page(cls, query, limit, after=None, sort="id"):
+        """Returns a single page of orders from a query
+
+        Pages are selected with a WHERE key > after clause instead of an
+        OFFSET so every page costs the same no matter how deep it is. The
+        items of all the orders in the page are loaded with one extra query.
+
+        The orders are ordered by id, or with sort="total_price" by their
+        total price and then id, and with sort="-total_price" the other way
+        around. The key of a page sorted by id is the id of its last order,
+        the key of a page sorted by total is its (total_price, id).
+
+        :param query: the query of orders to page through
+        :type query: BaseQuery
+        :param limit: the maximum number of orders in the page
+        :type limit: int
+        :param after: the key of the last order on the previous page
+        :type after: int or tuple
+        :param sort: one of SORTS
+        :type sort: str
+
+        :return: the orders in the page and the key to continue after,
+                 which is None on the last page
+        :rtype: tuple
+
+        """
+        logger.info("Processing page of %s orders after %s by %s ...", limit, after, sort)
+        descending = sort.startswith("-")
+        by_total = sort.lstrip("-") == "total_price"
+        key = tuple_(cls.total_price, cls.id) if by_total else cls.id
+        query = query.options(selectinload(cls.items))
+        if after is not None:
+            after = tuple_(*after) if by_total else after
+            query = query.filter(key < after if descending else key > after)
+        columns = [cls.total_price, cls.id] if by_total else [cls.id]
+        if descending:
+            columns = [column.desc() for column in columns]
+        # fetch one extra row to find out if there is a next page
+        orders = query.order_by(*columns).limit(limit + 1).all()
+        if len(orders) > limit:
+            orders = orders[:limit]
+            last = orders[-1]
+            return orders, (last.total_price, last.id) if by_total else last.id
+        return orders, None
+
+    @classmethod
+    def iter_pages(cls, query, chunk_size, after=None, sort="id"):
+        """Iterates over all of the orders of a query one page at a time
+
+        :param query: the query of orders to read
+        :type query: BaseQuery
+        :param chunk_size: the number of orders to read at a time
+        :type chunk_size: int
+        :param after: only read the orders after this key, see keyset_page
+        :type after: int or tuple
+        :param sort: one of SORTS
+        :type sort: str
+
+        :return: a generator of lists of orders, in the order of sort
+        :rtype: generator
+
+        """
+        # the session only holds weak references to the orders it loaded, so
+        # pages that the caller is done with can be garbage collected
+        while True:
+            orders, after = cls.keyset_page(query, chunk_size, after, sort)
+            if orders:
+                yield orders
+            if after is None:
+                return
 
     # @classmethod
     # def find_by_category(cls, category):
@@ -364,3 +1063,9 @@ class CustomerOrder(db.Model):
     #     """
     #     logger.info("Processing gender query for %s ...", gender.name)
     #     return cls.query.filter(cls.gender == gender)
+
+
+@event.listens_for(db.Model.metadata, "after_drop")
+def clear_order_cache(target, connection, **kwargs):  # pylint: disable=unused-argument
+    """Forgets the cached orders when the tables are dropped"""
+    CustomerOrder.cache.clear()
@@ -0,0 +1,121 @@
+# Copyright 2016, 2021 John Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Database connection pool for the orders Service
+
+engine_options() turns the DB_* settings into the SQLALCHEMY_ENGINE_OPTIONS
+of Flask-SQLAlchemy. Every worker keeps a TimedQueuePool of connections,
+which records how long requests wait to check one out, unless the service
+runs behind PgBouncer in transaction pooling mode: PgBouncer then does the
+pooling and the service opens a connection per transaction. pool_stats()
+reports the state of a pool for GET /stats.
+"""
+import threading
+import time
+from sqlalchemy import exc
+from sqlalchemy.pool import NullPool, QueuePool
+
+
+class TimedQueuePool(QueuePool):
+    """A QueuePool that records how long checkouts wait for a connection"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        timed_out = False
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            timed_out = True
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            with self._stats_lock:
+                self.checkouts += 1
+                self.timeouts += timed_out
+                self.wait_time += waited
+                self.max_wait = max(self.max_wait, waited)
+
+
+def engine_options(config):
+    """Builds the SQLAlchemy engine options from the configuration
+
+    Options already in SQLALCHEMY_ENGINE_OPTIONS win over the DB_* settings.
+    SQLite gets none, its pools don't take them.
+
+    :param config: the Flask app configuration
+    :type config: dict
+
+    :return: the keyword arguments for create_engine()
+    :rtype: dict
+
+    """
+    options = {}
+    if not config["SQLALCHEMY_DATABASE_URI"].startswith("sqlite"):
+        options["connect_args"] = {"connect_timeout": config["DB_CONNECT_TIMEOUT"]}
+        if config["DB_PGBOUNCER"]:
+            # PgBouncer hands the server connection to another client after
+            # every transaction, so a pool here would only hold on to them.
+            # psycopg2 never prepares statements on the server, which
+            # transaction pooling doesn't support.
+            options["poolclass"] = NullPool
+        else:
+            options.update(
+                poolclass=TimedQueuePool,
+                pool_size=config["DB_POOL_SIZE"],
+                max_overflow=config["DB_MAX_OVERFLOW"],
+                pool_timeout=config["DB_POOL_TIMEOUT"],
+                pool_recycle=config["DB_POOL_RECYCLE"],
+                pool_pre_ping=config["DB_POOL_PRE_PING"],
+            )
+    options.update(config.get("SQLALCHEMY_ENGINE_OPTIONS") or {})
+    return options
+
+
+def pool_stats(pool):
+    """Returns the state of a connection pool
+
+    :param pool: the pool of an engine
+    :type pool: Pool
+
+    :return: the pool class, the connections in use and the wait times
+    :rtype: dict
+
+    """
+    stats = {"class": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        stats.update(
+            size=pool.size(),
+            checked_in=pool.checkedin(),
+            checked_out=pool.checkedout(),
+            overflow=max(pool.overflow(), 0),
+            max_overflow=pool._max_overflow,  # pylint: disable=protected-access
+        )
+    if isinstance(pool, TimedQueuePool):
+        with pool._stats_lock:  # pylint: disable=protected-access
+            stats.update(
+                checkouts=pool.checkouts,
+                timeouts=pool.timeouts,
+                wait_time=pool.wait_time,
+                max_wait=pool.max_wait,
+            )
+    return stats
@@ -0,0 +1,182 @@
+# Copyright 2016, 2021 John Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+On-demand request profiling for the orders Service
+
+When PROFILING_ENABLED is set, a request with an X-Profile header or a
+profile query parameter runs under a profiler, from the moment the WSGI
+server hands it over until the last byte of its response, streamed ones
+included. The value picks the profiler:
+
+    pstats    - cProfile, saved in the binary pstats format (the default)
+    collapsed - a sampler that records the stack of the request's thread
+                every PROFILING_INTERVAL seconds, saved as collapsed stacks
+                ("frame;frame;frame count" lines) for flame graph tools
+
+The profile is stored in PROFILING_DIR under the id of the request, which
+is taken from the X-Request-ID header or made up, and returned in the
+X-Request-ID and X-Profile-Id headers of the response. GET
+/profiles/<request_id> downloads it. Only the newest PROFILING_KEEP
+profiles are kept.
+"""
+import cProfile
+import glob
+import os
+import re
+import sys
+import threading
+import uuid
+from collections import Counter
+from urllib.parse import parse_qs
+from flask import abort, current_app, send_file
+from service import status  # HTTP Status Codes
+
+FORMATS = {"pstats": ".prof", "collapsed": ".collapsed"}
+REQUEST_ID = re.compile(r"^[A-Za-z0-9_.-]{1,64}$")
+
+
+def init_app(app):
+    """Lets the requests of the app be profiled on demand"""
+    app.wsgi_app = ProfilingMiddleware(app.wsgi_app, app.config)
+    app.add_url_rule("/profiles/<request_id>", "profile", get_profile)
+
+
+def requested_format(environ):
+    """Returns the profiler a request asks for, or None"""
+    value = environ.get("HTTP_X_PROFILE")
+    if value is None:
+        values = parse_qs(environ.get("QUERY_STRING", "")).get("profile")
+        value = values[0] if values else None
+    value = (value or "").lower()
+    if value in ("", "0", "false", "no"):
+        return None
+    return value if value in FORMATS else "pstats"
+
+
+def request_id_of(environ):
+    """Returns the id the client gave the request, or a new one"""
+    request_id = environ.get("HTTP_X_REQUEST_ID", "")
+    if REQUEST_ID.match(request_id):
+        return request_id
+    return uuid.uuid4().hex
+
+
+class ProfilingMiddleware:
+    """WSGI middleware that profiles the requests that ask for it"""
+
+    def __init__(self, wsgi_app, config):
+        self.wsgi_app = wsgi_app
+        self.config = config
+
+    def __call__(self, environ, start_response):
+        profile_format = None
+        if self.config["PROFILING_ENABLED"]:
+            profile_format = requested_format(environ)
+        if profile_format is None:
+            return self.wsgi_app(environ, start_response)
+
+        request_id = request_id_of(environ)
+
+        def profiled_start_response(status_line, headers, exc_info=None):
+            headers = list(headers) + [("X-Request-ID", request_id),
+                                       ("X-Profile-Id", request_id)]
+            return start_response(status_line, headers, exc_info)
+
+        if profile_format == "collapsed":
+            profiler = StackSampler(self.config["PROFILING_INTERVAL"])
+        else:
+            profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            app_iter = self.wsgi_app(environ, profiled_start_response)
+            try:
+                body = list(app_iter)
+            finally:
+                if hasattr(app_iter, "close"):
+                    app_iter.close()
+        finally:
+            profiler.disable()
+            save_profile(self.config, request_id, profile_format, profiler)
+        return body
+
+
+class StackSampler:
+    """Samples the stack of the thread that enabled it at a fixed interval"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.stacks = Counter()
+        self._thread_id = None
+        self._stopped = threading.Event()
+        self._sampler = None
+
+    def enable(self):
+        """Starts sampling the current thread"""
+        self._thread_id = threading.get_ident()
+        self._sampler = threading.Thread(target=self._run, daemon=True)
+        self._sampler.start()
+
+    def disable(self):
+        """Stops sampling"""
+        self._stopped.set()
+        self._sampler.join()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)  # pylint: disable=protected-access
+            frames = []
+            while frame is not None:
+                code = frame.f_code
+                # no spaces, which separate the stack from its count
+                frame_name = f"{os.path.basename(code.co_filename)}:{code.co_name}"
+                frames.append(frame_name.replace(" ", "_"))
+                frame = frame.f_back
+            if frames:
+                self.stacks[";".join(reversed(frames))] += 1
+
+    def dump_stats(self, path):
+        """Writes the samples as collapsed stacks"""
+        with open(path, "w") as collapsed:
+            for stack, count in self.stacks.most_common():
+                collapsed.write(f"{stack} {count}\n")
+
+
+def save_profile(config, request_id, profile_format, profiler):
+    """Stores a profile and drops the oldest ones beyond PROFILING_KEEP"""
+    directory = config["PROFILING_DIR"]
+    os.makedirs(directory, exist_ok=True)
+    profiler.dump_stats(os.path.join(directory, request_id + FORMATS[profile_format]))
+    paths = sorted(glob.glob(os.path.join(directory, "*")), key=os.path.getmtime)
+    for path in paths[:max(len(paths) - config["PROFILING_KEEP"], 0)]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def get_profile(request_id):
+    """Returns the stored profile of a request"""
+    config = current_app.config
+    if not config["PROFILING_ENABLED"] or not REQUEST_ID.match(request_id):
+        abort(status.HTTP_404_NOT_FOUND)
+    for profile_format, extension in FORMATS.items():
+        path = os.path.join(config["PROFILING_DIR"], request_id + extension)
+        if os.path.exists(path):
+            if profile_format == "collapsed":
+                return send_file(path, mimetype="text/plain")
+            return send_file(path, mimetype="application/octet-stream", as_attachment=True,
+                             attachment_filename=request_id + extension)
+    abort(status.HTTP_404_NOT_FOUND)
+    return None
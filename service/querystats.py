@@ -0,0 +1,119 @@
+# Copyright 2016, 2021 John Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+SQL statement accounting for the orders Service
+
+Listeners on the SQLAlchemy engines time every statement. Statements run
+while handling a request add up in the request's QueryStats, kept in
+flask.g as g.query_stats: how many ran, the total time and the slowest of
+them. When the app runs in debug mode (or SERVER_TIMING is set) the
+totals are sent back in a Server-Timing header. Any statement slower than
+SLOW_QUERY_THRESHOLD seconds is logged with the route that ran it and the
+shape of its parameters, never their values.
+"""
+import logging
+import time
+from flask import current_app, g, has_app_context, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger("flask.app") # pylint: disable=invalid-name
+
+
+class QueryStats:
+    """The SQL statements run by a request"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.slowest = 0.0
+        self.slowest_statement = None
+
+    def add(self, statement, elapsed):
+        """Adds a statement that took elapsed seconds"""
+        self.count += 1
+        self.total += elapsed
+        if elapsed >= self.slowest:
+            self.slowest = elapsed
+            self.slowest_statement = statement
+
+    def server_timing(self):
+        """Formats the totals as the value of a Server-Timing header"""
+        return (f'db;dur={self.total * 1000:.2f};desc="{self.count} queries", '
+                f"db-slowest;dur={self.slowest * 1000:.2f}")
+
+
+def init_app(app):
+    """Accounts for the SQL statements run by every request of the app"""
+    app.before_request(start_request)
+    app.after_request(add_server_timing)
+    event.listen(Engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(Engine, "after_cursor_execute", after_cursor_execute)
+
+
+def start_request():
+    """Starts counting the statements of a request"""
+    g.query_stats = QueryStats()
+
+
+def add_server_timing(response):
+    """Sends the totals of the request back when debugging"""
+    if "query_stats" in g and (current_app.debug or current_app.config["SERVER_TIMING"]):
+        response.headers.add("Server-Timing", g.query_stats.server_timing())
+    return response
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):  # pylint: disable=unused-argument,too-many-arguments
+    """Notes when a statement starts"""
+    context.query_start = time.perf_counter()
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):  # pylint: disable=unused-argument,too-many-arguments
+    """Accounts for a statement that is done"""
+    start = getattr(context, "query_start", None)
+    if start is None:
+        return
+    elapsed = time.perf_counter() - start
+    in_request = has_request_context()
+    if in_request and "query_stats" in g:
+        g.query_stats.add(statement, elapsed)
+    threshold = current_app.config["SLOW_QUERY_THRESHOLD"] if has_app_context() else None
+    if threshold and elapsed >= threshold:
+        route = "no request"
+        if in_request:
+            route = f"{request.method} {request.url_rule or request.path}"
+        logger.warning("Slow query: %.1f ms in %s with parameters %s: %s", elapsed * 1000,
+                       route, parameters_shape(parameters, executemany), statement)
+
+
+def parameters_shape(parameters, executemany=False):
+    """Describes the parameters of a statement without their values
+
+    :param parameters: the parameters passed to the DBAPI cursor
+    :param executemany: whether they are a list of parameter sets
+    :type executemany: bool
+
+    :return: the names or positions of the parameters with their types
+    :rtype: str
+
+    """
+    if executemany:
+        rows = list(parameters)
+        shape = parameters_shape(rows[0]) if rows else "()"
+        return f"{len(rows)} x {shape}"
+    if isinstance(parameters, dict):
+        return "{" + ", ".join(f"{key}: {type(value).__name__}"
+                               for key, value in parameters.items()) + "}"
+    return "(" + ", ".join(type(value).__name__ for value in parameters or ()) + ")"
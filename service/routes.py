@@ -17,11 +17,14 @@ order Store Service
 
 Paths:
 ------
-GET /orders - Returns a list all of the orders
+GET /orders - Returns a page of the orders (see limit and next)
+GET /orders?stream=1 - Streams all of the orders as newline delimited JSON
 GET /orders/{id} - Returns the order with a given id number
 POST /orders - creates a new order record in the database
+POST /orders/batch - creates many orders and their items at once
 PUT /orders/{id} - updates a order record in the database
 POST /orders/{id}/items - adds an item to the order
+POST /orders/{id}/items/batch - adds many items to the order at once
 DELETE /orders/{id} - deletes a order record in the database
 DELETE /orders/{order_id}/items/{item_id}> - deletes the item in the order
 POST /orders/{id}/cancel - cancels the order (change status to Cancelled)
@@ -29,15 +32,21 @@ POST /orders/{id}/cancel - cancels the order (change status to Cancelled)
 
 import os
 import sys
+import json
+import base64
 import logging
-from flask import Flask, jsonify, request, url_for, make_response, abort
+from flask import Flask, jsonify, request, url_for, make_response, abort, stream_with_context
 from flask_restx import Api, Resource, fields, reqparse, inputs
+from jsonschema import Draft4Validator
+from jsonschema.exceptions import best_match
 from werkzeug.exceptions import NotFound
 
 # For this example we'll use SQLAlchemy, a popular ORM that supports a
 # variety of backends including SQLite, MySQL, and PostgreSQL
 from flask_sqlalchemy import SQLAlchemy
-from service.models import CustomerOrder, Item, DataValidationError, Status
+from service.models import db, CustomerOrder, Item, DataValidationError, Status
+from service.pool import pool_stats
+from service.serialization import compile_serializer, dumps, json_response
 
 # Import Flask application
 from . import app
@@ -53,6 +62,17 @@ def index():
     return app.send_static_file("index.html")
 
 
+######################################################################
+# GET STATS
+######################################################################
+@app.route("/stats")
+def stats():
+    """Returns the statistics of the order cache and the connection pool"""
+    return jsonify(
+        cache=CustomerOrder.cache.stats(), pool=pool_stats(db.engine.pool)
+    ), status.HTTP_200_OK
+
+
 ######################################################################
 # Configure Swagger before initializing it
 ######################################################################
@@ -82,7 +102,13 @@ order_model = api.inherit(
         'id': fields.Integer(readOnly=True,
                              description='The unique id assigned internally by service'),
         'items': fields.List(cls_or_instance=fields.Raw,
-                             description='collection of all items assigned to an order')
+                             description='collection of all items assigned to an order'),
+        'version': fields.Integer(readOnly=True,
+                                  description='Goes up on every change to the order or its items'),
+        'item_count': fields.Integer(readOnly=True,
+                                     description='The number of items in the order'),
+        'total_price': fields.Float(readOnly=True,
+                                    description='The price of the items times their quantity')
     }
 )
 
@@ -107,12 +133,120 @@ item_model = api.inherit(
     }
 )
 
+created_item_model = api.inherit(
+    'CreatedItemModel',
+    item_model,
+    {
+        'location': fields.String(readOnly=True,
+                                  description='The URL of the new item'),
+    }
+)
+
+# Define the models of the batch endpoint
+batch_item_model = api.model('BatchItem', {
+    'quantity': fields.Integer(required=True,
+                               description='The quantity of the item'),
+    'price': fields.Float(required=True,
+                          description='The price of the item'),
+    'item_name': fields.String(required=True,
+                               description='The name of the item')
+})
+
+batch_order_model = api.inherit(
+    'BatchOrder',
+    create_model,
+    {
+        'items': fields.List(fields.Nested(batch_item_model),
+                             description='the items of the order')
+    }
+)
+
+batch_result_model = api.model('BatchResult', {
+    'created': fields.List(fields.Integer,
+                           description='The ids of the orders that were created'),
+    'errors': fields.List(fields.Raw,
+                          description='The index and error message of every rejected entry')
+})
+
+# Define the models of the reporting endpoint
+report_group_model = api.model('ReportGroup', {
+    'key': fields.Raw(description='The status, customer id or item name of the group'),
+    'orders': fields.Integer(description='The number of orders in the group'),
+    'items': fields.Integer(description='The number of items of those orders'),
+    'revenue': fields.Float(description='The total price of those items')
+})
+
+report_model = api.model('Report', {
+    'group_by': fields.String(description='What the orders are grouped by'),
+    'groups': fields.List(fields.Nested(report_group_model),
+                          description='The groups, by status or with the most revenue first')
+})
+
+# the models above document the responses, these shape them
+serialize_order = compile_serializer(order_model)
+serialize_item = compile_serializer(item_model)
+serialize_created_item = compile_serializer(created_item_model)
+
+# validate every entry of a batch on its own so one bad entry can be reported
+order_validator = Draft4Validator(create_model.__schema__)
+batch_item_validator = Draft4Validator(batch_item_model.__schema__)
+
 # query string arguments (used as filters in List function)
 order_args = reqparse.RequestParser()
 order_args.add_argument('customer_id', type=int, location='args',
                         required=False, help='List Orders by customer_id')
 order_args.add_argument('item', type=str, location='args',
                         required=False, help='List Orders by item')
+order_args.add_argument('status', type=str, location='args', action='append',
+                        required=False, choices=[order_status.name for order_status in Status],
+                        help='List Orders with this status, can be repeated')
+order_args.add_argument('address', type=str, location='args',
+                        required=False, help='List Orders with an address that starts with this')
+order_args.add_argument('min_total', type=float, location='args',
+                        required=False, help='List Orders with at least this total price')
+order_args.add_argument('max_total', type=float, location='args',
+                        required=False, help='List Orders with at most this total price')
+order_args.add_argument('sort', type=str, location='args', required=False, default='id',
+                        choices=CustomerOrder.SORTS, help='Order the list by id or total price')
+order_args.add_argument('limit', type=inputs.positive, location='args',
+                        required=False, help='Maximum number of Orders per page')
+order_args.add_argument('next', type=str, location='args',
+                        required=False, help='Cursor of the page to return')
+order_args.add_argument('stream', type=inputs.boolean, location='args', required=False,
+                        help='Stream all of the Orders as application/x-ndjson')
+
+# query string arguments of the order report
+report_args = reqparse.RequestParser()
+report_args.add_argument('group_by', type=str, location='args', required=True,
+                         choices=('status', 'customer', 'item'),
+                         help='Group the orders by status, customer or item')
+report_args.add_argument('customer_id', type=int, location='args',
+                         required=False, help='Only report on the Orders of a customer')
+report_args.add_argument('item', type=str, location='args',
+                         required=False, help='Only report on the Orders with this item')
+report_args.add_argument('address', type=str, location='args', required=False,
+                         help='Only report on the Orders with an address that starts with this')
+report_args.add_argument('status', type=str, location='args', action='append',
+                         required=False, choices=[order_status.name for order_status in Status],
+                         help='Only report on the Orders with this status, can be repeated')
+report_args.add_argument('min_total', type=float, location='args',
+                         required=False, help='Only report on Orders with at least this total')
+report_args.add_argument('max_total', type=float, location='args',
+                         required=False, help='Only report on Orders with at most this total')
+report_args.add_argument('limit', type=inputs.positive, location='args', required=False,
+                         help='Maximum number of customers or items to report on')
+
+NDJSON = "application/x-ndjson"
+
+# the query string arguments that select the orders, see search_orders()
+SEARCH_ARGS = ('customer_id', 'item', 'status', 'address', 'min_total', 'max_total')
+
+# the report of every group_by
+REPORTS = {
+    'status': CustomerOrder.report_by_status,
+    'customer': CustomerOrder.report_by_customer,
+    'item': CustomerOrder.report_by_item,
+}
 
 
 ######################################################################
@@ -148,30 +282,44 @@ class OrderResource(Resource):
     # RETRIEVE AN ORDER
     # ------------------------------------------------------------------
     @api.doc('get_orders')
+    @api.response(200, 'Success', order_model)
+    @api.response(304, 'Order not modified since the ETag in If-None-Match')
     @api.response(404, 'Order not found')
-    @api.marshal_with(order_model)
     def get(self, order_id):
         """
         Retrieve a single Order
-        This endpoint will return an Order based on it's id
+        This endpoint will return an Order based on it's id. The response
+        has an ETag, send it back in If-None-Match to get a 304 Not Modified
+        while the order hasn't changed
         """
         app.logger.info("Request for order with id: %s", order_id)
-        order = CustomerOrder.find(order_id)
+        if request.if_none_match:
+            version = CustomerOrder.find_version(order_id)
+            if version is not None and request.if_none_match.contains_weak(
+                    order_etag(order_id, version)):
+                app.logger.info("Order %s not modified", order_id)
+                response = app.response_class(status=status.HTTP_304_NOT_MODIFIED)
+                response.set_etag(order_etag(order_id, version))
+                return response
+
+        order = CustomerOrder.find_serialized(order_id)
         if not order:
             abort(status.HTTP_404_NOT_FOUND,
                   "Order with id '{}' was not found.".format(order_id))
 
         app.logger.info("Returning order: %s", order_id)
-        return order.serialize(), status.HTTP_200_OK
+        response = json_response(serialize_order(order), status.HTTP_200_OK)
+        response.set_etag(order_etag(order_id, order["version"]))
+        return response
 
     # ------------------------------------------------------------------
     # UPDATE AN EXISTING ORDER
     # ------------------------------------------------------------------
     @api.doc('update_orders')
+    @api.response(200, 'Success', order_model)
     @api.response(404, 'Order not found')
     @api.response(400, 'The posted Order data was not valid')
     @api.expect(order_model, validate=True)
-    @api.marshal_with(order_model)
     def put(self, order_id):
         """
         Update an Order
@@ -189,7 +337,7 @@ class OrderResource(Resource):
         order.id = order_id
         order.update()
         app.logger.info("Order with ID [%s] updated.", order.id)
-        return order.serialize(), status.HTTP_200_OK
+        return json_response(serialize_order(order.serialize()), status.HTTP_200_OK)
 
     # ------------------------------------------------------------------
     # DELETE A ORDER
@@ -222,26 +370,46 @@ class OrderCollection(Resource):
     # ------------------------------------------------------------------
     @api.doc('list_orders')
     @api.expect(order_args, validate=True)
-    @api.marshal_list_with(order_model)
+    @api.response(200, 'Success', [order_model])
+    @api.produces(["application/json", NDJSON])
     def get(self):
-        """Returns all of the orders"""
+        """Returns a page of the orders
+
+        Use the limit argument to set the page size and pass the cursor
+        from the Link header of a response as next to get the next page.
+        The customer_id, item, status (repeat it for more than one),
+        address prefix and min_total/max_total filters can be combined and
+        sort=total_price or sort=-total_price orders the list by total price.
+        Ask for stream=1 or Accept: application/x-ndjson to get all of the
+        orders instead, as one JSON document per line
+        """
         app.logger.info("Request for order list")
-        orders = []
         args = order_args.parse_args()
-        if args['customer_id']:
-            app.logger.info('Filtering by customer id: %s',
-                            args['customer_id'])
-            orders = CustomerOrder.find_by_customer_id(args['customer_id'])
-        elif args['item']:
-            app.logger.info('Filtering by item: %s', args['item'])
-            orders = CustomerOrder.find_by_including_item(args['item'])
-        else:
-            app.logger.info('Returning unfiltered list.')
-            orders = CustomerOrder.all()
-
-        results = [order.serialize() for order in orders]
+        query = search_orders(args)
+
+        sort = args['sort']
+        after = decode_cursor(args['next'], sort) if args['next'] else None
+        if args['stream'] or request.accept_mimetypes.best_match(
+                ["application/json", NDJSON]) == NDJSON:
+            app.logger.info("Streaming orders")
+            return app.response_class(
+                stream_with_context(stream_orders(query, after, sort)), mimetype=NDJSON)
+
+        limit = min(args['limit'] or app.config['DEFAULT_PAGE_SIZE'],
+                    app.config['MAX_PAGE_SIZE'])
+        orders, last = CustomerOrder.keyset_page(query, limit, after, sort)
+
+        results = [serialize_order(order.serialize()) for order in orders]
+        headers = {}
+        if last is not None:
+            params = {key: args[key] for key in SEARCH_ARGS if args[key] is not None}
+            if sort != 'id':
+                params['sort'] = sort
+            next_url = api.url_for(OrderCollection, limit=limit, next=encode_cursor(last),
+                                   _external=True, **params)
+            headers["Link"] = '<{}>; rel="next"'.format(next_url)
         app.logger.info("Returning %d orders", len(results))
-        return results, status.HTTP_200_OK
+        return json_response(results, status.HTTP_200_OK, headers)
 
     # ------------------------------------------------------------------
     # ADD A NEW Order
@@ -249,7 +417,7 @@ class OrderCollection(Resource):
     @api.doc('create_orders')
     @api.response(400, 'The posted data was not valid')
     @api.expect(create_model, validate=True)
-    @api.marshal_with(order_model, code=201)
+    @api.response(201, 'Order created', order_model)
     def post(self):
         """
         Creates a Order
@@ -265,7 +433,82 @@ class OrderCollection(Resource):
             OrderResource, order_id=order.id, _external=True)
 
         app.logger.info("Order with ID [%s] created.", order.id)
-        return message, status.HTTP_201_CREATED, {"Location": location_url}
+        return json_response(serialize_order(message), status.HTTP_201_CREATED,
+                             {"Location": location_url})
+
+
+######################################################################
+#  PATH: /orders/batch
+######################################################################
+@api.route('/orders/batch', strict_slashes=False)
+class OrderBatch(Resource):
+    """ Creates many Orders in a single request """
+
+    @api.doc('create_orders_batch')
+    @api.expect([batch_order_model])
+    @api.response(201, 'Orders created', batch_result_model)
+    @api.response(400, 'None of the posted orders were valid', batch_result_model)
+    @api.response(413, 'Too many orders in the batch')
+    def post(self):
+        """
+        Creates a batch of Orders
+        This endpoint validates every order in the posted list, creates the
+        valid ones with their items in a single transaction and reports
+        the ids that were created and the errors of the rejected entries
+        """
+        app.logger.info("Request to create a batch of customer orders")
+        check_content_type("application/json")
+        data = api.payload
+        if not isinstance(data, list):
+            raise DataValidationError("Invalid batch: body of request must be a list of orders")
+        if len(data) > app.config['MAX_BATCH_SIZE']:
+            abort(status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                  "A batch can't have more than {} orders".format(app.config['MAX_BATCH_SIZE']))
+
+        orders = []
+        errors = []
+        for index, entry in enumerate(data):
+            try:
+                orders.append(deserialize_batch_order(entry))
+            except DataValidationError as error:
+                errors.append({"index": index, "message": str(error)})
+
+        ids = CustomerOrder.create_many(orders) if orders else []
+        app.logger.info("Created %d orders, rejected %d", len(ids), len(errors))
+        result = {"created": ids, "errors": errors}
+        if not ids and errors:
+            return json_response(result, status.HTTP_400_BAD_REQUEST)
+        return json_response(result, status.HTTP_201_CREATED)
+
+
+######################################################################
+#  PATH: /reports/orders
+######################################################################
+@api.route('/reports/orders', strict_slashes=False)
+class OrderReport(Resource):
+    """ Aggregates of the Orders computed by the database """
+
+    @api.doc('report_orders')
+    @api.expect(report_args, validate=True)
+    @api.response(200, 'Success', report_model)
+    @api.response(400, 'The query arguments were not valid')
+    def get(self):
+        """
+        Reports on the orders
+        This endpoint counts the orders and adds up their revenue by
+        status, by customer or by item name with a GROUP BY, so only the
+        groups are sent back. By customer and by item, the limit groups
+        with the most revenue are returned
+        """
+        args = report_args.parse_args()
+        app.logger.info("Request for order report by %s", args['group_by'])
+        query = search_orders(args)
+        limit = min(args['limit'] or app.config['DEFAULT_PAGE_SIZE'],
+                    app.config['MAX_PAGE_SIZE'])
+        groups = REPORTS[args['group_by']](query, limit)
+        app.logger.info("Returning %d groups", len(groups))
+        return json_response({"group_by": args['group_by'], "groups": groups},
+                             status.HTTP_200_OK)
 
 
 ######################################################################
@@ -276,6 +519,7 @@ class OrderCollection(Resource):
 class CancelResource(Resource):
     """ Cancel actions on a Order """
     @api.doc('cancel_orders')
+    @api.response(200, 'Order cancelled', order_model)
     @api.response(404, 'Order not found')
     @api.response(409, 'The Order is not available for cancellation')
     def put(self, order_id):
@@ -284,22 +528,24 @@ class CancelResource(Resource):
         This endpoint will cancel an order based on order_id and notify other services
         """
         app.logger.info(f"Request to cancel order with id {order_id}")
-        order = CustomerOrder.find(order_id)
-        if not order:
+        order_status, order = CustomerOrder.cancel(order_id)
+        if order_status is None:
             abort(status.HTTP_404_NOT_FOUND,
                   "Order with id '{}' was not found.".format(order_id))
 
-        if order.status == Status.Completed or order.status == Status.Returned:
+        if order_status != Status.Cancelled:
             abort(status.HTTP_409_CONFLICT,
-                  f"Order with id {order_id} is [{order.status.name}], request refused.")
+                  f"Order with id {order_id} is [{order_status.name}], request refused.")
+
+        if order is None:
+            # deleted right after it was cancelled
+            abort(status.HTTP_404_NOT_FOUND,
+                  "Order with id '{}' was not found.".format(order_id))
 
-        order.id = order_id
-        order.status = Status.Cancelled
-        order.save()
         app.logger.info("Notify Shipping to cancel shipment...")
         app.logger.info("Notify Billing to refund payment...")
         app.logger.info(f"Order with id {order_id} cancelled successfully.")
-        return order.serialize(), status.HTTP_200_OK
+        return json_response(serialize_order(order), status.HTTP_200_OK)
 
 
 ######################################################################
@@ -319,8 +565,8 @@ class ItemResource(Resource):
     # RETRIEVE A ITEM
     # ------------------------------------------------------------------
     @api.doc('get_items')
-    @api.response(404, 'Order not found')
-    @api.marshal_with(item_model)
+    @api.response(200, 'Success', item_model)
+    @api.response(404, 'Order or Item not found')
     def get(self, item_id, order_id):
         """
         Retrieve a single item in an order
@@ -328,42 +574,44 @@ class ItemResource(Resource):
         """
         app.logger.info(
             f"Request for item with id {item_id} in order {order_id}")
-        order = CustomerOrder.find(order_id)
-        if not order:
+        order = CustomerOrder.find_cached(order_id)
+        if order is not None:
+            order_found = True
+            item = next((item for item in order["items"] if item["item_id"] == item_id), None)
+        else:
+            order_found, item = Item.find_in_order(order_id, item_id)
+            item = item.serialize() if item else None
+        if not order_found:
             abort(status.HTTP_404_NOT_FOUND,
                   f"Order with id {order_id} was not found")
 
-        item = Item.find(item_id)
         if not item:
             abort(status.HTTP_404_NOT_FOUND,
                   f"Item with id {item_id} was not found in order {order_id}")
 
         app.logger.info(f"Returning item: {item_id}")
-        return item.serialize(), status.HTTP_200_OK
+        return json_response(serialize_item(item), status.HTTP_200_OK)
 
     # ------------------------------------------------------------------
     # DELETE A ITEM
     # ------------------------------------------------------------------
     @api.doc('delete_items')
     @api.response(204, 'Item deleted')
-    @api.response(404, 'Item not found')
+    @api.response(404, 'Order or Item not found')
     def delete(self, item_id, order_id):
         """
         Delete a Item
         This endpoint will delete a Item based the id specified in the path
         """
         app.logger.info(f"Request to delete item with id {item_id}")
-        order = CustomerOrder.find(order_id)
-        if not order:
+        order_found, item = Item.find_in_order(order_id, item_id)
+        if not order_found:
             abort(status.HTTP_404_NOT_FOUND,
                   f"Order with id {order_id} is not found")
-        item = Item.find(item_id)
-
-        if item:
-            if int(item.order_id) != int(order_id):
-                abort(status.HTTP_404_NOT_FOUND,
-                      f"Item with id {item.order_id} is not in order with id {order_id}")
-            item.delete()
+        if not item:
+            abort(status.HTTP_404_NOT_FOUND,
+                  f"Item with id {item_id} is not in order with id {order_id}")
+        item.delete()
         app.logger.info(f"item with id {item_id} delete complete")
         return '', status.HTTP_204_NO_CONTENT
 
@@ -382,23 +630,75 @@ class ItemCollection(Resource):
     @api.doc('create_item')
     @api.expect(create_item_model, validate=True)
     @api.response(400, 'The posted data was not valid')
-    @api.response(201, 'Item created successfully')
-    @api.marshal_with(item_model, code=201)
+    @api.response(201, 'Item created successfully', item_model)
     def post(self, order_id):
         """Adds item to an order."""
         app.logger.info("Request to add an item to an order")
         check_content_type("application/json")
-        customer_order = CustomerOrder.find_or_404(order_id)
+        if not CustomerOrder.exists(order_id):
+            abort(status.HTTP_404_NOT_FOUND,
+                  f"Order with id {order_id} was not found")
         item = Item()
         item.deserialize(api.payload)
-        customer_order.items.append(item)
-        customer_order.save()
+        item.order_id = order_id
+        item.create()
         message = item.serialize()
         location_url = api.url_for(
             ItemResource, order_id=order_id, item_id=message['item_id'], _external=True)
 
         app.logger.info(f"Item with ID {message['item_id']} is created")
-        return message, status.HTTP_201_CREATED, {"Location": location_url}
+        return json_response(serialize_item(message), status.HTTP_201_CREATED,
+                             {"Location": location_url})
+
+
+######################################################################
+#  PATH: /orders/{order_id}/items/batch
+######################################################################
+@api.route('/orders/<int:order_id>/items/batch', strict_slashes=False)
+@api.param('order_id', 'The Order identifier')
+class ItemBatch(Resource):
+    """ Adds many Items to an Order in a single request """
+
+    @api.doc('create_items_batch')
+    @api.expect([batch_item_model])
+    @api.response(400, 'The posted data was not valid')
+    @api.response(404, 'Order not found')
+    @api.response(201, 'Items created', [created_item_model])
+    @api.response(413, 'Too many items in the batch')
+    def post(self, order_id):
+        """
+        Adds a batch of items to an order
+        All of the items are added in a single transaction, if any of them
+        is not valid none of them are added
+        """
+        app.logger.info("Request to add a batch of items to order %s", order_id)
+        check_content_type("application/json")
+        data = api.payload
+        if not isinstance(data, list):
+            raise DataValidationError("Invalid batch: body of request must be a list of items")
+        if len(data) > app.config['MAX_BATCH_SIZE']:
+            abort(status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                  "A batch can't have more than {} items".format(app.config['MAX_BATCH_SIZE']))
+        items = []
+        for index, item_data in enumerate(data):
+            error = best_match(batch_item_validator.iter_errors(item_data))
+            if error:
+                raise DataValidationError(
+                    "Invalid Item at index {}: {}".format(index, error.message))
+            items.append(Item().deserialize(dict(item_data, order_id=order_id)))
+        if not CustomerOrder.exists(order_id):
+            abort(status.HTTP_404_NOT_FOUND,
+                  f"Order with id {order_id} was not found")
+
+        Item.create_many(order_id, items)
+        results = []
+        for item in items:
+            message = item.serialize()
+            message["location"] = api.url_for(
+                ItemResource, order_id=order_id, item_id=item.id, _external=True)
+            results.append(serialize_created_item(message))
+        app.logger.info("Added %d items to order %s", len(results), order_id)
+        return json_response(results, status.HTTP_201_CREATED)
 
 
 ######################################################################
@@ -416,6 +716,86 @@ def check_content_type(media_type):
     )
 
 
+def search_orders(args):
+    """Returns the query of the orders that match the parsed SEARCH_ARGS"""
+    criteria = {key: args[key] for key in SEARCH_ARGS if args[key] is not None}
+    if criteria:
+        app.logger.info("Filtering by %s", criteria)
+    return CustomerOrder.search(
+        customer_id=args['customer_id'],
+        item=args['item'],
+        statuses=[getattr(Status, name) for name in args['status'] or ()],
+        address=args['address'],
+        min_total=args['min_total'],
+        max_total=args['max_total'],
+    )
+
+
+def deserialize_batch_order(data):
+    """Validates an entry of a batch and makes an order with its items"""
+    error = best_match(order_validator.iter_errors(data))
+    if error:
+        raise DataValidationError("Invalid order: " + error.message)
+    order = CustomerOrder().deserialize(data)
+    items = data.get("items", [])
+    if not isinstance(items, list):
+        raise DataValidationError("Invalid order: items must be a list")
+    for item_data in items:
+        error = best_match(batch_item_validator.iter_errors(item_data))
+        if error:
+            raise DataValidationError("Invalid Item: " + error.message)
+        order.items.append(Item().deserialize(dict(item_data, order_id=None)))
+    return order
+
+
+def stream_orders(query, after=None, sort="id"):
+    """Yields the orders of a query as lines of JSON
+
+    The orders are read one keyset page of STREAM_CHUNK_SIZE at a time and
+    written as soon as each page is serialized, so memory use doesn't grow
+    with the number of orders. The session is closed after every page, so
+    the connection goes back to the pool, out of any transaction, while a
+    slow client reads the page
+    """
+    count = 0
+    chunk_size = app.config['STREAM_CHUNK_SIZE']
+    for orders in CustomerOrder.iter_pages(query, chunk_size, after, sort):
+        chunk = b"".join(dumps(serialize_order(order.serialize())) + b"\n" for order in orders)
+        count += len(orders)
+        db.session.close()
+        yield chunk
+    app.logger.info("Streamed %d orders", count)
+
+
+def order_etag(order_id, version):
+    """Returns the ETag of a version of an order"""
+    return "{}-{}".format(order_id, version)
+
+
+def encode_cursor(key):
+    """Encodes the keyset key of the last order on a page as an opaque cursor
+
+    The key is the id of the order, or its (total_price, id) when the
+    orders are sorted by total
+    """
+    if isinstance(key, tuple):
+        cursor = {"total_price": key[0], "id": key[1]}
+    else:
+        cursor = {"id": key}
+    return base64.urlsafe_b64encode(json.dumps(cursor).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor, sort="id"):
+    """Decodes a cursor made by encode_cursor back into the key of a sort"""
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        if sort == "id":
+            return int(key["id"])
+        return float(key["total_price"]), int(key["id"])
+    except (ValueError, KeyError, TypeError) as error:
+        raise DataValidationError("Invalid cursor: " + cursor) from error
+
+
 def abort(error_code: int, message: str):
     """Logs errors before aborting"""
     app.logger.error(message)
@@ -0,0 +1,87 @@
+# Copyright 2016, 2021 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Test cases for the order cache
+
+Test cases can be run with:
+    nosetests tests/test_cache.py
+"""
+import unittest
+from unittest.mock import patch
+from service.cache import Cache, LRUCache, NullCache, make_backend
+
+
+######################################################################
+#  C A C H E   T E S T   C A S E S
+######################################################################
+class TestCache(unittest.TestCase):
+    """Test Cases for the order cache"""
+
+    def test_lru_cache_evicts_least_recently_used(self):
+        """The least recently used entry is evicted when the cache is full"""
+        cache = LRUCache(maxsize=2, ttl=60)
+        cache.set(1, "one")
+        cache.set(2, "two")
+        self.assertEqual(cache.get(1), "one")
+        cache.set(3, "three")
+        self.assertIsNone(cache.get(2))
+        self.assertEqual(cache.get(1), "one")
+        self.assertEqual(cache.get(3), "three")
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    @patch("service.cache.time.monotonic")
+    def test_lru_cache_entries_expire(self, monotonic):
+        """Entries are gone once their time to live is over"""
+        monotonic.return_value = 100.0
+        cache = LRUCache(maxsize=2, ttl=5)
+        cache.set(1, "one")
+        monotonic.return_value = 104.0
+        self.assertEqual(cache.get(1), "one")
+        monotonic.return_value = 105.0
+        self.assertIsNone(cache.get(1))
+        self.assertEqual(cache.stats()["size"], 0)
+
+    def test_cache_counts_hits_and_misses(self):
+        """The cache counts hits and misses and forgets invalidated keys"""
+        cache = Cache(LRUCache(maxsize=10, ttl=60))
+        self.assertIsNone(cache.get(1))
+        cache.set(1, {"id": 1})
+        self.assertEqual(cache.get(1), {"id": 1})
+        cache.invalidate(1)
+        self.assertIsNone(cache.get(1))
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 2))
+        self.assertAlmostEqual(stats["hit_ratio"], 1 / 3)
+        self.assertEqual(stats["backend"], "LRUCache")
+
+    def test_cache_counts_stale_values_as_misses(self):
+        """A value that is out of date is removed and counted as a miss"""
+        cache = Cache(LRUCache(maxsize=10, ttl=60))
+        cache.set(1, {"version": 1})
+        self.assertEqual(cache.get(1, lambda value: value["version"] == 1), {"version": 1})
+        self.assertIsNone(cache.get(1, lambda value: value["version"] == 2))
+        self.assertIsNone(cache.backend.get(1))
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 1))
+
+    def test_make_backend(self):
+        """Backends are picked by name or by import path"""
+        config = {"ORDER_CACHE_SIZE": 5, "ORDER_CACHE_TTL": 1}
+        backend = make_backend(dict(config, ORDER_CACHE_BACKEND="lru"))
+        self.assertIsInstance(backend, LRUCache)
+        self.assertEqual(backend.maxsize, 5)
+        self.assertIsInstance(make_backend(dict(config, ORDER_CACHE_BACKEND="null")), NullCache)
+        backend = make_backend(dict(config, ORDER_CACHE_BACKEND="service.cache:NullCache"))
+        self.assertIsInstance(backend, NullCache)
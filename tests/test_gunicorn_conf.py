@@ -0,0 +1,102 @@
+# Copyright 2016, 2021 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Test cases for the gunicorn settings
+
+Test cases can be run with:
+    nosetests tests/test_gunicorn_conf.py
+"""
+import os
+import runpy
+import tempfile
+import unittest
+from unittest.mock import patch
+from service import app
+from service.models import db
+
+CONF_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "gunicorn.conf.py")
+
+
+######################################################################
+#  G U N I C O R N   S E T T I N G S   T E S T   C A S E S
+######################################################################
+class TestGunicornConf(unittest.TestCase):
+    """Test Cases for gunicorn.conf.py"""
+
+    def setUp(self):
+        """Gives the settings a metrics directory so that they don't make one"""
+        metrics_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(metrics_dir.cleanup)
+        self.metrics_dir = metrics_dir.name
+
+    def _load(self, **env):
+        """Reads the settings with some environment variables set"""
+        env.setdefault("PROMETHEUS_MULTIPROC_DIR", self.metrics_dir)
+        with patch.dict(os.environ, env):
+            return runpy.run_path(CONF_PATH)
+
+    def test_defaults(self):
+        """The defaults are sync workers sized from the CPU count"""
+        with patch.dict(os.environ):
+            for name in [name for name in os.environ if name.startswith("GUNICORN_")]:
+                del os.environ[name]
+            conf = self._load()
+        self.assertEqual(conf["worker_class"], "sync")
+        self.assertEqual(conf["workers"], os.cpu_count() * 2 + 1)
+        self.assertEqual(conf["threads"], 1)
+        self.assertFalse(conf["preload_app"])
+        self.assertEqual(conf["max_requests"], 0)
+
+    def test_settings_from_environment(self):
+        """Every tunable can be set from the environment"""
+        conf = self._load(GUNICORN_WORKER_CLASS="gthread", GUNICORN_WORKERS="3",
+                          GUNICORN_PRELOAD="true", GUNICORN_KEEPALIVE="75",
+                          GUNICORN_MAX_REQUESTS="1000", GUNICORN_GRACEFUL_TIMEOUT="10")
+        self.assertEqual(conf["worker_class"], "gthread")
+        self.assertEqual(conf["workers"], 3)
+        self.assertEqual(conf["threads"], 4)
+        self.assertTrue(conf["preload_app"])
+        self.assertEqual(conf["keepalive"], 75)
+        self.assertEqual(conf["max_requests"], 1000)
+        self.assertEqual(conf["max_requests_jitter"], 100)
+        self.assertEqual(conf["graceful_timeout"], 10)
+
+    def test_post_fork_disposes_engine(self):
+        """Forked workers get a connection pool of their own"""
+        conf = self._load(GUNICORN_WORKER_CLASS="sync")
+        with app.app_context():
+            pool = db.engine.pool
+            conf["post_fork"](None, None)
+            self.assertIsNot(db.engine.pool, pool)
+
+    def test_metrics_dir(self):
+        """A metrics directory is only made when none is set, and removed on exit"""
+        stale = os.path.join(self.metrics_dir, "counter_1.db")
+        open(stale, "w").close()
+        conf = self._load(GUNICORN_DB_UPGRADE="false")
+        self.assertIsNone(conf["metrics_dir"])
+        with patch.dict(os.environ, PROMETHEUS_MULTIPROC_DIR=self.metrics_dir):
+            conf["on_starting"](None)
+        self.assertFalse(os.path.exists(stale))
+        conf["on_exit"](None)
+        self.assertTrue(os.path.isdir(self.metrics_dir))
+
+        with patch.dict(os.environ):
+            os.environ.pop("PROMETHEUS_MULTIPROC_DIR", None)
+            conf = runpy.run_path(CONF_PATH)
+        metrics_dir = conf["metrics_dir"]
+        self.assertTrue(os.path.isdir(metrics_dir))
+        conf["on_exit"](None)
+        self.assertFalse(os.path.exists(metrics_dir))
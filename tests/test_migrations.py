@@ -0,0 +1,157 @@
+# Copyright 2016, 2021 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Test cases for the schema migrations
+
+Test cases can be run with:
+    nosetests tests/test_migrations.py
+"""
+import logging
+import unittest
+import threading
+import config
+from sqlalchemy import inspect, text
+from service import migrations
+from service.models import CustomerOrder, db
+from service import app
+
+DATABASE_URI = config.DATABASE_URI
+
+
+######################################################################
+#  M I G R A T I O N   T E S T   C A S E S
+######################################################################
+class TestMigrations(unittest.TestCase):
+    """Test Cases for the schema migrations"""
+
+    @classmethod
+    def setUpClass(cls):
+        """This runs once before the entire test suite"""
+        app.config["TESTING"] = True
+        app.config["DEBUG"] = False
+        app.config["SQLALCHEMY_DATABASE_URI"] = DATABASE_URI
+        app.logger.setLevel(logging.CRITICAL)
+        CustomerOrder.init_db(app)
+
+    @classmethod
+    def tearDownClass(cls):
+        """This runs once after the entire test suite"""
+        db.session.close()
+
+    def setUp(self):
+        """Build the tables the way the first release of the service did"""
+        db.drop_all()
+        migrations.schema_version.drop(db.engine, checkfirst=True)
+        db.create_all()
+        for index in ("ix_customer_order_customer_id", "ix_item_item_name", "ix_item_order_id_id",
+                      "ix_customer_order_total_price_id", "ix_customer_order_status_id",
+                      "ix_customer_order_address"):
+            db.engine.execute(text(f"DROP INDEX {index}"))
+        for column in ("version", "item_count", "total_price"):
+            db.engine.execute(text(f"ALTER TABLE customer_order DROP COLUMN {column}"))
+
+    def tearDown(self):
+        """This runs after each test"""
+        db.session.remove()
+        db.drop_all()
+
+    def _index_names(self, table):
+        """Returns the names of the indexes on a table"""
+        return {index["name"] for index in inspect(db.engine).get_indexes(table)}
+
+    def test_upgrade_adds_indexes(self):
+        """Upgrading an existing database adds the lookup indexes"""
+        self.assertEqual(migrations.current_version(db.engine), 0)
+        self.assertNotIn("ix_item_order_id_id", self._index_names("item"))
+        applied = migrations.upgrade(db.engine)
+        self.assertEqual(applied, [version for version, _ in migrations.MIGRATIONS])
+        self.assertTrue({"ix_customer_order_customer_id", "ix_customer_order_status_id",
+                         "ix_customer_order_address"} <= self._index_names("customer_order"))
+        self.assertTrue({"ix_item_item_name", "ix_item_order_id_id"} <= self._index_names("item"))
+        self.assertEqual(migrations.current_version(db.engine), migrations.MIGRATIONS[-1][0])
+
+    def test_upgrade_adds_order_version(self):
+        """Upgrading an existing database adds versions to the existing orders"""
+        db.engine.execute(text(
+            "INSERT INTO customer_order (customer_id, address, status) VALUES (1, 'here', 'Received')"
+        ))
+        migrations.upgrade(db.engine)
+        columns = {column["name"] for column in inspect(db.engine).get_columns("customer_order")}
+        self.assertIn("version", columns)
+        self.assertEqual(CustomerOrder.find_version(1), 1)
+
+    def test_upgrade_adds_order_totals(self):
+        """Upgrading an existing database counts the items of the existing orders"""
+        db.engine.execute(text(
+            "INSERT INTO customer_order (customer_id, address, status) VALUES "
+            "(1, 'here', 'Received'), (2, 'there', 'Received')"
+        ))
+        db.engine.execute(text(
+            "INSERT INTO item (order_id, quantity, price, item_name) VALUES "
+            "(1, 2, 1.5, 'egg'), (1, NULL, 4, 'ham')"
+        ))
+        migrations.upgrade(db.engine)
+        self.assertIn("ix_customer_order_total_price_id", self._index_names("customer_order"))
+        self.assertEqual(CustomerOrder.find(1).item_count, 2)
+        self.assertEqual(CustomerOrder.find(1).total_price, 7.0)
+        self.assertEqual(CustomerOrder.find(2).item_count, 0)
+        self.assertEqual(CustomerOrder.find(2).total_price, 0.0)
+
+    def test_upgrade_is_idempotent(self):
+        """Upgrading twice only applies the migrations once"""
+        migrations.upgrade(db.engine)
+        self.assertEqual(migrations.upgrade(db.engine), [])
+
+    @unittest.skipIf(DATABASE_URI.endswith(":memory:"), "an in-memory database isn't shared")
+    def test_concurrent_upgrades(self):
+        """Instances starting together create the tables and migrate them once"""
+        db.drop_all()
+        migrations.schema_version.drop(db.engine, checkfirst=True)
+        results = []
+        engine = db.engine
+
+        def upgrade():
+            try:
+                results.append(migrations.upgrade(engine, db.metadata))
+            except Exception as error:  # pylint: disable=broad-except
+                results.append(error)
+
+        threads = [threading.Thread(target=upgrade) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([result for result in results if isinstance(result, Exception)], [])
+        self.assertEqual(sorted(version for applied in results for version in applied),
+                         [version for version, _ in migrations.MIGRATIONS])
+
+    def test_db_upgrade_command(self):
+        """flask db-upgrade builds an empty database"""
+        db.drop_all()
+        migrations.schema_version.drop(db.engine, checkfirst=True)
+        runner = app.test_cli_runner()
+        result = runner.invoke(args=["db-upgrade"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("ix_item_order_id_id", self._index_names("item"))
+        self.assertEqual(migrations.current_version(db.engine), migrations.MIGRATIONS[-1][0])
+        result = runner.invoke(args=["db-upgrade"])
+        self.assertEqual(result.output.strip(), "The database is up to date")
+
+    def test_upgrade_new_database(self):
+        """Migrations run cleanly against a database that create_all just built"""
+        db.drop_all()
+        db.create_all()
+        migrations.upgrade(db.engine)
+        self.assertIn("ix_item_order_id_id", self._index_names("item"))
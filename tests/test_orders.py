@@ -26,7 +26,9 @@ While debugging just these tests it's convinient to use this:
 import os
 import logging
 import unittest
+import itertools
 import config
+from sqlalchemy import event
 from werkzeug.exceptions import NotFound
 from service.models import CustomerOrder, DataValidationError, db, Item, Status
 from service import app
@@ -36,6 +38,14 @@ from .factories import CustomerOrderFactory
 DATABASE_URI = config.DATABASE_URI
 TEST_ADDRESS = "random address"
 TEST_ITEM = "Egg"
+# a value for every criteria of CustomerOrder.search()
+SEARCH_CRITERIA = {
+    "customer_id": {"customer_id": 1},
+    "item": {"item": TEST_ITEM},
+    "statuses": {"statuses": [Status.Received, Status.Processing]},
+    "address": {"address": "12 Main*"},
+    "total": {"min_total": 10.0, "max_total": 20.0},
+}
 
 
 def _make_item(item_id=1, item_name=TEST_ITEM, quantity=6, price=1, order_id=10):
@@ -234,6 +244,292 @@ class TestCustomerOrderModel(unittest.TestCase):
         self.assertEqual(orders[0].customer_id, 1)
         self.assertEqual(orders[0].address, TEST_ADDRESS)
 
+    def test_create_many_customer_orders(self):
+        """Create a batch of orders with their items in one transaction"""
+        orders = [CustomerOrder(customer_id=customer_id, address=TEST_ADDRESS,
+                                status=Status.Received,
+                                items=[_make_item(item_id=None, order_id=None)
+                                       for _ in range(customer_id)])
+                  for customer_id in range(1, 4)]
+        ids = CustomerOrder.create_many(orders)
+        self.assertEqual(len(ids), 3)
+        for order_id, customer_id in zip(ids, range(1, 4)):
+            order = CustomerOrder.find(order_id)
+            self.assertEqual(order.customer_id, customer_id)
+            self.assertEqual(len(order.items), customer_id)
+            self.assertTrue(all(item.order_id == order_id for item in order.items))
+
+    def test_create_many_items(self):
+        """Add a batch of items to an order"""
+        order = CustomerOrder(customer_id=1, address=TEST_ADDRESS)
+        order.create()
+        self.assertTrue(CustomerOrder.exists(order.id))
+        self.assertFalse(CustomerOrder.exists(0))
+        items = [_make_item(item_id=None, order_id=None, item_name=name)
+                 for name in ("Egg", "Ham", "Jam")]
+        ids = Item.create_many(order.id, items)
+        self.assertEqual([item.id for item in items], ids)
+        db.session.expire_all()
+        self.assertEqual(sorted(item.item_name for item in CustomerOrder.find(order.id).items),
+                         ["Egg", "Ham", "Jam"])
+
+    def test_cancel_a_customer_order(self):
+        """Cancel orders with a conditional update"""
+        received = CustomerOrder(customer_id=1, address=TEST_ADDRESS, status=Status.Received)
+        received.create()
+        completed = CustomerOrder(customer_id=1, address=TEST_ADDRESS, status=Status.Completed)
+        completed.create()
+        Item.create_many(received.id, [_make_item(item_id=None, order_id=None, price=price)
+                                       for price in (2, 1)])
+        order_status, order = CustomerOrder.cancel(received.id)
+        self.assertEqual(order_status, Status.Cancelled)
+        db.session.expire_all()
+        self.assertEqual(CustomerOrder.find(received.id).status, Status.Cancelled)
+        self.assertEqual(CustomerOrder.find(received.id).version, 3)
+        # the cancelled order is returned as serialize() would
+        expected = CustomerOrder.find(received.id).serialize()
+        expected["items"].sort(key=lambda item: item["item_id"])
+        self.assertEqual(order, expected)
+        # cancelling again is allowed
+        self.assertEqual(CustomerOrder.cancel(received.id)[0], Status.Cancelled)
+        self.assertEqual(CustomerOrder.cancel(completed.id), (Status.Completed, None))
+        self.assertEqual(CustomerOrder.find(completed.id).status, Status.Completed)
+        self.assertEqual(CustomerOrder.find(completed.id).version, 1)
+        self.assertEqual(CustomerOrder.cancel(0), (None, None))
+
+    def test_find_item_in_order(self):
+        """Find an item by its id within its order"""
+        order = CustomerOrder(customer_id=1, address=TEST_ADDRESS,
+                              items=[_make_item(item_id=None)])
+        order.create()
+        other = CustomerOrder(customer_id=2, address=TEST_ADDRESS)
+        other.create()
+        item_id = order.items[0].id
+        found, item = Item.find_in_order(order.id, item_id)
+        self.assertTrue(found)
+        self.assertEqual(item.id, item_id)
+        self.assertEqual(Item.find_in_order(other.id, item_id), (True, None))
+        self.assertEqual(Item.find_in_order(0, item_id), (False, None))
+
+    def test_keyset_page(self):
+        """Page through orders by id"""
+        for customer_id in (1, 2, 1, 1, 2):
+            CustomerOrder(customer_id=customer_id, address=TEST_ADDRESS).create()
+        orders, last_id = CustomerOrder.keyset_page(CustomerOrder.query, 2)
+        self.assertEqual([order.id for order in orders], [1, 2])
+        self.assertEqual(last_id, 2)
+        orders, last_id = CustomerOrder.keyset_page(CustomerOrder.query, 2, last_id)
+        self.assertEqual([order.id for order in orders], [3, 4])
+        orders, last_id = CustomerOrder.keyset_page(CustomerOrder.query, 2, last_id)
+        self.assertEqual([order.id for order in orders], [5])
+        self.assertIsNone(last_id)
+        # pages of a filtered query
+        query = CustomerOrder.find_by_customer_id(1)
+        orders, last_id = CustomerOrder.keyset_page(query, 2)
+        self.assertEqual([order.id for order in orders], [1, 3])
+        orders, last_id = CustomerOrder.keyset_page(query, 2, last_id)
+        self.assertEqual([order.id for order in orders], [4])
+        self.assertIsNone(last_id)
+
+    def test_order_totals(self):
+        """The item count and total price follow every write of the items"""
+        order = CustomerOrder(customer_id=1, address=TEST_ADDRESS,
+                              items=[_make_item(item_id=None, quantity=2, price=1.5),
+                                     _make_item(item_id=None, quantity=None, price=4)])
+        order.create()
+        self.assertEqual((order.item_count, order.total_price), (2, 7.0))
+        item = _make_item(item_id=None, order_id=order.id, quantity=3, price=2)
+        item.create()
+        self.assertEqual(order.serialize()["item_count"], 3)
+        self.assertEqual(order.serialize()["total_price"], 13.0)
+        Item.create_many(order.id, [_make_item(item_id=None, order_id=None, price=0.5)
+                                    for _ in range(2)])
+        self.assertEqual((order.item_count, order.total_price), (5, 19.0))
+        Item.find(item.id).delete()
+        self.assertEqual((order.item_count, order.total_price), (4, 13.0))
+        # and the batch of orders
+        ids = CustomerOrder.create_many([
+            CustomerOrder(customer_id=2, address=TEST_ADDRESS, status=Status.Received,
+                          items=[_make_item(item_id=None, order_id=None, quantity=q)
+                                 for q in range(1, count + 1)])
+            for count in (0, 3)
+        ])
+        self.assertEqual([(CustomerOrder.find(order_id).item_count,
+                           CustomerOrder.find(order_id).total_price) for order_id in ids],
+                         [(0, 0.0), (3, 6.0)])
+
+    def test_delete_item_twice(self):
+        """Two deletes of the same item only take it off the totals once"""
+        order = CustomerOrder(customer_id=1, address=TEST_ADDRESS,
+                              items=[_make_item(item_id=None, quantity=2, price=price)
+                                     for price in (1.5, 4)])
+        order.create()
+        item_id = order.items[0].id
+        # the same item loaded by two requests
+        first = Item.find(item_id)
+        db.session.expunge(first)
+        second = Item.find(item_id)
+        self.assertTrue(second.delete())
+        self.assertFalse(first.delete())
+        order = CustomerOrder.find(order.id)
+        self.assertEqual((order.item_count, order.total_price), (1, 8.0))
+        self.assertEqual(order.version, 2)
+        self.assertNotIn(item_id, [item.id for item in order.items])
+
+    def test_order_totals_are_exact(self):
+        """Adding and removing items gives back exactly the same total"""
+        order = CustomerOrder(customer_id=1, address=TEST_ADDRESS,
+                              items=[_make_item(item_id=None, quantity=1, price=price)
+                                     for price in (0.1, 0.2)])
+        order.create()
+        self.assertEqual(order.total_price, 0.3)
+        items = [_make_item(item_id=None, order_id=order.id, quantity=1, price=price)
+                 for price in (0.1, 0.2)]
+        for item in items:
+            item.create()
+        self.assertEqual(order.total_price, 0.6)
+        for item in order.items:
+            item.delete()
+        self.assertEqual((order.item_count, order.total_price), (0, 0.0))
+        query = CustomerOrder.filter_by_total(CustomerOrder.query, max_total=0)
+        self.assertEqual([found.id for found in query], [order.id])
+
+    def test_keyset_page_by_total(self):
+        """Page through orders by their total price"""
+        for price in (5, 1, 3, 1, 4):
+            CustomerOrder(customer_id=1, address=TEST_ADDRESS,
+                          items=[_make_item(item_id=None, quantity=1, price=price)]).create()
+        query = CustomerOrder.filter_by_total(CustomerOrder.query, min_total=2)
+        orders, last = CustomerOrder.keyset_page(query, 2, sort="total_price")
+        self.assertEqual([order.id for order in orders], [3, 5])
+        self.assertEqual(last, (4.0, 5))
+        orders, last = CustomerOrder.keyset_page(query, 2, last, sort="total_price")
+        self.assertEqual([order.id for order in orders], [1])
+        self.assertIsNone(last)
+        # largest first, ties broken by id
+        pages = list(CustomerOrder.iter_pages(CustomerOrder.query, 2, sort="-total_price"))
+        self.assertEqual([[order.id for order in page] for page in pages],
+                         [[1, 5], [3, 4], [2]])
+        self.assertEqual(CustomerOrder.filter_by_total(CustomerOrder.query, 1, 3).count(), 3)
+
+    def test_reports(self):
+        """Aggregate orders by status, customer and item"""
+        for customer_id, status, prices in ((1, Status.Received, (2, 3)),
+                                            (2, Status.Received, (10,)),
+                                            (1, Status.Completed, (4,)),
+                                            (3, Status.Cancelled, ())):
+            CustomerOrder(customer_id=customer_id, address=TEST_ADDRESS, status=status,
+                          items=[_make_item(item_id=None, item_name=f"item {price % 2}",
+                                            quantity=1, price=price)
+                                 for price in prices]).create()
+        self.assertEqual(CustomerOrder.report_by_status(CustomerOrder.query), [
+            {"key": "Received", "orders": 2, "items": 3, "revenue": 15.0},
+            {"key": "Completed", "orders": 1, "items": 1, "revenue": 4.0},
+            {"key": "Cancelled", "orders": 1, "items": 0, "revenue": 0.0},
+        ])
+        self.assertEqual(CustomerOrder.report_by_customer(CustomerOrder.query, 2), [
+            {"key": 2, "orders": 1, "items": 1, "revenue": 10.0},
+            {"key": 1, "orders": 2, "items": 3, "revenue": 9.0},
+        ])
+        self.assertEqual(CustomerOrder.report_by_item(CustomerOrder.query), [
+            {"key": "item 0", "orders": 3, "items": 3, "revenue": 16.0},
+            {"key": "item 1", "orders": 1, "items": 1, "revenue": 3.0},
+        ])
+        # only the items of the orders of the query
+        query = CustomerOrder.filter_by_status(CustomerOrder.query, [Status.Completed])
+        self.assertEqual(CustomerOrder.report_by_item(query), [
+            {"key": "item 0", "orders": 1, "items": 1, "revenue": 4.0},
+        ])
+
+    def test_search(self):
+        """Search orders by any combination of criteria"""
+        for customer_id, status, address, price in (
+                (1, Status.Received, "12 Main Street", 5),
+                (1, Status.Completed, "12 Main Street", 15),
+                (1, Status.Received, "12 main street", 15),
+                (2, Status.Processing, "12 Main* Street", 15),
+                (2, Status.Received, "3 Elm Street", 15)):
+            CustomerOrder(customer_id=customer_id, address=address, status=status,
+                          items=[_make_item(item_id=None, quantity=1, price=price,
+                                            item_name=f"item {customer_id}")]).create()
+
+        def search(**criteria):
+            return sorted(order.id for order in CustomerOrder.search(**criteria))
+        self.assertEqual(search(), [1, 2, 3, 4, 5])
+        self.assertEqual(search(customer_id=1, statuses=[Status.Received]), [1, 3])
+        self.assertEqual(search(statuses=[Status.Received, Status.Processing],
+                                min_total=10), [3, 4, 5])
+        self.assertEqual(search(address="12 Main"), [1, 2, 4])
+        self.assertEqual(search(address="12 Main*"), [4])
+        self.assertEqual(search(item="item 2", address="12 M", max_total=20), [4])
+
+    def test_search_uses_indexes(self):
+        """Every combination of search criteria is served by indexes"""
+        postgres = db.engine.dialect.name == "postgresql"
+        for count in range(1, len(SEARCH_CRITERIA) + 1):
+            for names in itertools.combinations(SEARCH_CRITERIA, count):
+                criteria = {}
+                for name in names:
+                    criteria.update(SEARCH_CRITERIA[name])
+                for sort in CustomerOrder.SORTS:
+                    with self.subTest(criteria=names, sort=sort):
+                        statement, parameters = self._capture_statement(
+                            lambda: CustomerOrder.keyset_page(
+                                CustomerOrder.search(**criteria), 100, sort=sort))
+                        plan = (self._postgres_plan(statement, parameters) if postgres
+                                else self._sqlite_plan(statement, parameters))
+                        self.assertEqual([step for step in plan if step[1]], [])
+
+    def _capture_statement(self, function):
+        """Returns the statement and parameters that function runs, the tables being empty"""
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, *args):
+            statements.append((statement, parameters))
+
+        event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            function()
+        finally:
+            event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+        self.assertEqual(len(statements), 1)
+        return statements[0]
+
+    @staticmethod
+    def _sqlite_plan(statement, parameters):
+        """Returns every step of the plan of a statement and whether it reads a whole table"""
+        connection = db.engine.raw_connection()
+        try:
+            rows = connection.cursor().execute("EXPLAIN QUERY PLAN " + statement, parameters)
+            # SEARCH reads a range of an index, SCAN everything
+            return [(row[3], row[3].startswith("SCAN ")) for row in rows]
+        finally:
+            connection.close()
+
+    @staticmethod
+    def _postgres_plan(statement, parameters):
+        """Returns every scan of the plan of a statement and whether it reads a whole table"""
+        connection = db.engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            # the tables are empty, only check that the indexes can be used
+            cursor.execute("SET LOCAL enable_seqscan = off")
+            cursor.execute("EXPLAIN (FORMAT JSON) " + statement, parameters)
+            nodes = [cursor.fetchone()[0][0]["Plan"]]
+            connection.rollback()
+        finally:
+            connection.close()
+        scans = []
+        while nodes:
+            node = nodes.pop()
+            nodes.extend(node.get("Plans", []))
+            if node["Node Type"] == "Seq Scan":
+                scans.append((node["Relation Name"], True))
+            elif node["Node Type"] in ("Index Scan", "Index Only Scan"):
+                # an index scan without a condition reads all of the index
+                scans.append((node["Index Name"], "Index Cond" not in node))
+        return scans
+
     # def test_find_by_availability(self):
     #     """Find Pets by Availability"""
     #     Pet(name="fido", category="dog", available=True).create()
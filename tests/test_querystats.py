@@ -0,0 +1,50 @@
+# Copyright 2016, 2021 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Test cases for the SQL statement accounting
+
+Test cases can be run with:
+    nosetests tests/test_querystats.py
+"""
+import unittest
+from service.querystats import QueryStats, parameters_shape
+
+
+######################################################################
+#  Q U E R Y   S T A T S   T E S T   C A S E S
+######################################################################
+class TestQueryStats(unittest.TestCase):
+    """Test Cases for the SQL statement accounting"""
+
+    def test_totals(self):
+        """The statements of a request add up"""
+        stats = QueryStats()
+        stats.add("SELECT 1", 0.002)
+        stats.add("SELECT 2", 0.010)
+        stats.add("SELECT 3", 0.001)
+        self.assertEqual(stats.count, 3)
+        self.assertAlmostEqual(stats.total, 0.013)
+        self.assertEqual(stats.slowest_statement, "SELECT 2")
+        self.assertEqual(stats.server_timing(),
+                         'db;dur=13.00;desc="3 queries", db-slowest;dur=10.00')
+
+    def test_parameters_shape(self):
+        """Parameters are described by name and type only"""
+        self.assertEqual(parameters_shape({"customer_id": 3, "name": "secret"}),
+                         "{customer_id: int, name: str}")
+        self.assertEqual(parameters_shape((3, "secret", None)), "(int, str, NoneType)")
+        self.assertEqual(parameters_shape(()), "()")
+        self.assertEqual(parameters_shape([(1, 2.5), (2, 3.5)], executemany=True),
+                         "2 x (int, float)")
@@ -0,0 +1,65 @@
+# Copyright 2016, 2021 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Test cases for the fast response serialization
+
+Test cases can be run with:
+    nosetests tests/test_serialization.py
+"""
+import json
+import unittest
+from flask_restx import marshal
+from service.models import CustomerOrder, Item, Status
+from service.routes import app, order_model, item_model, serialize_order, serialize_item
+from service.serialization import dumps, json_response
+
+
+######################################################################
+#  S E R I A L I Z A T I O N   T E S T   C A S E S
+######################################################################
+class TestSerialization(unittest.TestCase):
+    """Test Cases for the compiled serializers"""
+
+    def setUp(self):
+        """Build an order with items in memory"""
+        self.order = CustomerOrder(
+            id=7, customer_id=3, address="1 Main Street", status=Status.Processing, version=2,
+            items=[Item(id=i, order_id=7, quantity=None if i else 2, price=1.25,
+                        item_name=f"item {i}") for i in range(3)],
+        )
+
+    def test_serializers_match_marshal(self):
+        """The compiled serializers give the same result as marshal()"""
+        data = self.order.serialize()
+        self.assertEqual(serialize_order(data), dict(marshal(data, order_model)))
+        item = data["items"][0]
+        self.assertEqual(serialize_item(item), dict(marshal(item, item_model)))
+
+    def test_serializer_shapes_data(self):
+        """Keys missing from the data are None and extra keys are dropped"""
+        self.assertEqual(serialize_item({"item_id": 1, "secret": "x"}), {
+            "item_id": 1, "order_id": None, "quantity": None, "price": None, "item_name": None,
+        })
+
+    def test_json_response(self):
+        """Responses are JSON encoded with the status and headers asked for"""
+        data = serialize_order(self.order.serialize())
+        with app.app_context():
+            resp = json_response(data, 201, {"Location": "/orders/7"})
+        self.assertEqual(resp.status_code, 201)
+        self.assertEqual(resp.mimetype, "application/json")
+        self.assertEqual(resp.headers["Location"], "/orders/7")
+        self.assertEqual(json.loads(resp.get_data()), data)
+        self.assertEqual(json.loads(dumps(data)), data)
@@ -25,14 +25,22 @@ Test cases can be run with the following:
 """
 
 import os
+import gzip
+import json
+import pstats
 import logging
+import tempfile
 import unittest
+from contextlib import contextmanager
+from unittest.mock import patch
 import config
+from sqlalchemy import event
 
 # from unittest.mock import MagicMock, patch
 from urllib.parse import quote_plus
 from werkzeug.exceptions import NotFound
 from service import status  # HTTP Status Codes
+from service import compression
 from service.models import db, init_db, Item, CustomerOrder, Status
 from service.routes import app
 from .factories import CustomerOrderFactory
@@ -93,6 +101,31 @@ class TestCustomerOrderServer(unittest.TestCase):  # pylint: disable=too-many-pu
             orders.append(test_order)
         return orders
 
+    @contextmanager
+    def _count_queries(self):
+        """Counts the SQL statements run while the block executes"""
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            yield statements
+        finally:
+            event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+
+    def _add_items(self, order_id, count):
+        """Adds count items to an order"""
+        for i in range(count):
+            resp = self.app.post(
+                f"{BASE_URL}/{order_id}/items",
+                json={"order_id": order_id, "quantity": 1,
+                      "price": 2.5, "item_name": f"item {i}"},
+                content_type=CONTENT_TYPE_JSON
+            )
+            self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+
     def test_index(self):
         """Test the Home Page"""
         resp = self.app.get("/")
@@ -106,6 +139,294 @@ class TestCustomerOrderServer(unittest.TestCase):  # pylint: disable=too-many-pu
         data = resp.get_json()
         self.assertEqual(len(data), 5)
 
+    def test_get_orders_list_query_count(self):
+        """Listing orders takes the same number of queries for any number of orders"""
+        query_counts = []
+        for count in (2, 6):
+            orders = self._create_orders(count)
+            for order in orders:
+                self._add_items(order.id, 3)
+            for url in (BASE_URL, f"{BASE_URL}?customer_id={orders[0].customer_id}",
+                        f"{BASE_URL}?item=item%200"):
+                db.session.expunge_all()
+                with self._count_queries() as statements:
+                    resp = self.app.get(url)
+                self.assertEqual(resp.status_code, status.HTTP_200_OK)
+                query_counts.append((url.partition("?")[2].split("=")[0], len(statements)))
+            data = self.app.get(BASE_URL).get_json()
+            self.assertTrue(all(len(order["items"]) == 3 for order in data))
+        self.assertEqual(query_counts[:3], query_counts[3:])
+
+    def test_get_order_query_count(self):
+        """Getting an order loads its items with a bounded number of queries"""
+        order = self._create_orders(1)[0]
+        self._add_items(order.id, 5)
+        db.session.expunge_all()
+        with self._count_queries() as statements:
+            resp = self.app.get(f"{BASE_URL}/{order.id}")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(resp.get_json()["items"]), 5)
+        self.assertLessEqual(len(statements), 2)
+
+    def test_get_orders_paginated(self):
+        """Get the list of orders one page at a time"""
+        orders = self._create_orders(5)
+        resp = self.app.get(BASE_URL, query_string="limit=2")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual([order["id"] for order in data],
+                         [order.id for order in orders[:2]])
+        # follow the Link headers to the last page
+        seen = [order["id"] for order in data]
+        while "Link" in resp.headers:
+            next_url = resp.headers["Link"].split(">")[0].lstrip("<")
+            resp = self.app.get(next_url)
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            seen.extend(order["id"] for order in resp.get_json())
+        self.assertEqual(seen, [order.id for order in orders])
+
+    def test_get_orders_page_size_limits(self):
+        """Page sizes are capped and must be positive"""
+        self._create_orders(3)
+        app.config["MAX_PAGE_SIZE"], max_page_size = 2, app.config["MAX_PAGE_SIZE"]
+        try:
+            resp = self.app.get(BASE_URL, query_string="limit=50")
+        finally:
+            app.config["MAX_PAGE_SIZE"] = max_page_size
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(resp.get_json()), 2)
+        self.assertIn('rel="next"', resp.headers["Link"])
+        resp = self.app.get(BASE_URL, query_string="limit=0")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_stream_orders(self):
+        """Stream all of the orders as newline delimited JSON"""
+        orders = self._create_orders(5)
+        app.config["STREAM_CHUNK_SIZE"], chunk_size = 2, app.config["STREAM_CHUNK_SIZE"]
+        try:
+            resp = self.app.get(BASE_URL, query_string="stream=1")
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            self.assertEqual(resp.mimetype, "application/x-ndjson")
+            self.assertTrue(resp.is_streamed)
+            lines = resp.get_data().splitlines()
+            self.assertEqual([json.loads(line)["id"] for line in lines],
+                             [order.id for order in orders])
+            # content negotiation and filters
+            resp = self.app.get(BASE_URL, headers={"Accept": "application/x-ndjson"},
+                                query_string=f"customer_id={orders[0].customer_id}")
+            self.assertEqual(resp.mimetype, "application/x-ndjson")
+            lines = resp.get_data().splitlines()
+            self.assertEqual([json.loads(line)["id"] for line in lines], [orders[0].id])
+        finally:
+            app.config["STREAM_CHUNK_SIZE"] = chunk_size
+        # plain JSON is still the default
+        resp = self.app.get(BASE_URL, headers={"Accept": "*/*"})
+        self.assertEqual(resp.mimetype, "application/json")
+
+    def test_stream_orders_transactions(self):
+        """Streaming ends the transaction of every page before sending it"""
+        self._create_orders(5)
+        # the tests share an app context, so requests don't remove the session
+        db.session.remove()
+        events = []
+        listeners = {name: (lambda conn, *args, name=name: events.append(name))
+                     for name in ("begin", "commit", "rollback")}
+        for name, listener in listeners.items():
+            event.listen(db.engine, name, listener)
+        app.config["STREAM_CHUNK_SIZE"], chunk_size = 2, app.config["STREAM_CHUNK_SIZE"]
+        try:
+            resp = self.app.get(BASE_URL, query_string="stream=1")
+            for _ in resp.response:
+                events.append("chunk")
+        finally:
+            app.config["STREAM_CHUNK_SIZE"] = chunk_size
+            for name, listener in listeners.items():
+                event.remove(db.engine, name, listener)
+        self.assertEqual(events, ["begin", "rollback", "chunk"] * 3)
+
+    def test_metrics(self):
+        """Requests are timed by route and status code on /metrics"""
+        order = self._create_orders(1)[0]
+        self.app.get(f"{BASE_URL}/{order.id}")
+        self.app.get(f"{BASE_URL}/0")
+        resp = self.app.get("/metrics")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertTrue(resp.content_type.startswith("text/plain"))
+        text = resp.get_data(as_text=True)
+        for sample in (
+                'orders_http_request_duration_seconds_count{method="GET",'
+                'route="/orders/<int:order_id>",status="200"}',
+                'orders_http_request_duration_seconds_count{method="GET",'
+                'route="/orders/<int:order_id>",status="404"}',
+                'orders_http_request_duration_seconds_count{method="POST",'
+                'route="/orders",status="201"}',
+                'orders_db_queries_per_request_count{route="/orders"}',
+                "orders_http_requests_in_progress ",
+                "orders_cache_hits ",
+                "orders_db_pool_",
+        ):
+            self.assertIn(sample, text)
+
+    def test_server_timing(self):
+        """The SQL time of a request is sent back in a Server-Timing header"""
+        order = self._create_orders(1)[0]
+        CustomerOrder.cache.clear()
+        resp = self.app.get(f"{BASE_URL}/{order.id}")
+        self.assertNotIn("Server-Timing", resp.headers)
+        CustomerOrder.cache.clear()
+        app.config["SERVER_TIMING"] = True
+        try:
+            resp = self.app.get(f"{BASE_URL}/{order.id}")
+        finally:
+            app.config["SERVER_TIMING"] = False
+        self.assertRegex(resp.headers["Server-Timing"],
+                         r'^db;dur=[0-9.]+;desc="[1-9][0-9]* queries", db-slowest;dur=[0-9.]+$')
+
+    def test_slow_query_log(self):
+        """Statements over the threshold are logged without their values"""
+        app.config["SLOW_QUERY_THRESHOLD"], threshold = 1e-9, app.config["SLOW_QUERY_THRESHOLD"]
+        try:
+            with self.assertLogs("flask.app", "WARNING") as logs:
+                self.app.get(BASE_URL, query_string="customer_id=8675309")
+        finally:
+            app.config["SLOW_QUERY_THRESHOLD"] = threshold
+        message = logs.output[0]
+        self.assertIn("Slow query", message)
+        self.assertIn("GET /orders", message)
+        self.assertIn("int", message)
+        self.assertNotIn("8675309", message)
+
+    def test_profile_request(self):
+        """A request asking for a profile is run under cProfile"""
+        order = self._create_orders(1)[0]
+        with tempfile.TemporaryDirectory() as directory:
+            app.config.update(PROFILING_ENABLED=True, PROFILING_DIR=directory)
+            try:
+                resp = self.app.get(BASE_URL, query_string=f"customer_id={order.customer_id}",
+                                    headers={"X-Profile": "pstats", "X-Request-ID": "req-1"})
+                self.assertEqual(resp.status_code, status.HTTP_200_OK)
+                self.assertEqual(len(resp.get_json()), 1)
+                self.assertEqual(resp.headers["X-Profile-Id"], "req-1")
+                stats = pstats.Stats(os.path.join(directory, "req-1.prof"))
+                functions = {function for _, _, function in stats.stats}
+                self.assertIn("keyset_page", functions)
+                resp = self.app.get("/profiles/req-1")
+                self.assertEqual(resp.status_code, status.HTTP_200_OK)
+                resp.close()
+                # collapsed stacks from a query flag, with a new request id
+                resp = self.app.get(BASE_URL, query_string="profile=collapsed")
+                request_id = resp.headers["X-Request-ID"]
+                resp = self.app.get(f"/profiles/{request_id}")
+                self.assertEqual(resp.mimetype, "text/plain")
+                for line in resp.get_data(as_text=True).splitlines():
+                    self.assertRegex(line, r"^\S+(;\S+)* [0-9]+$")
+                resp.close()
+            finally:
+                app.config["PROFILING_ENABLED"] = False
+        # nothing is profiled or served while profiling is off
+        resp = self.app.get(BASE_URL, headers={"X-Profile": "pstats"})
+        self.assertNotIn("X-Profile-Id", resp.headers)
+        resp = self.app.get("/profiles/req-1")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_compress_order_list(self):
+        """Lists of orders are gzipped for clients that accept it"""
+        orders = self._create_orders(20)
+        resp = self.app.get(BASE_URL, headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", resp.headers["Vary"])
+        data = gzip.decompress(resp.get_data())
+        self.assertEqual(int(resp.headers["Content-Length"]), len(resp.get_data()))
+        self.assertEqual([order["id"] for order in json.loads(data)], [order.id for order in orders])
+        # not without Accept-Encoding
+        resp = self.app.get(BASE_URL)
+        self.assertNotIn("Content-Encoding", resp.headers)
+        self.assertEqual(len(resp.get_json()), 20)
+
+    def test_choose_encoding(self):
+        """The content coding follows the q-values of Accept-Encoding"""
+        cases = {
+            "gzip": "gzip",
+            "gzip, br": "br",
+            "br;q=0.5, gzip": "gzip",
+            "gzip;q=0.5, br": "br",
+            "gzip;q=0, br;q=0": None,
+            "*": "br",
+            "*;q=0.5, gzip": "gzip",
+            "identity": None,
+        }
+        with patch.object(compression, "brotli", object()):
+            for header, encoding in cases.items():
+                with app.test_request_context(headers={"Accept-Encoding": header}):
+                    self.assertEqual(compression.choose_encoding(), encoding, header)
+        with patch.object(compression, "brotli", None):
+            with app.test_request_context(headers={"Accept-Encoding": "br, gzip;q=0.1"}):
+                self.assertEqual(compression.choose_encoding(), "gzip")
+
+    def test_compress_skips_small_responses(self):
+        """A single order is smaller than the threshold and sent as it is"""
+        order = self._create_orders(1)[0]
+        resp = self.app.get(f"{BASE_URL}/{order.id}", headers={"Accept-Encoding": "gzip"})
+        self.assertNotIn("Content-Encoding", resp.headers)
+        self.assertFalse(resp.headers["ETag"].startswith("W/"))
+        # once it is big enough the ETag becomes weak and still matches
+        self._add_items(order.id, 20)
+        resp = self.app.get(f"{BASE_URL}/{order.id}", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        etag = resp.headers["ETag"]
+        self.assertTrue(etag.startswith("W/"))
+        self.assertEqual(len(json.loads(gzip.decompress(resp.get_data()))["items"]), 20)
+        resp = self.app.get(f"{BASE_URL}/{order.id}",
+                            headers={"Accept-Encoding": "gzip", "If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertNotIn("Content-Encoding", resp.headers)
+
+    def test_compress_stream(self):
+        """Streamed listings are gzipped one chunk at a time"""
+        orders = self._create_orders(5)
+        app.config["STREAM_CHUNK_SIZE"], chunk_size = 2, app.config["STREAM_CHUNK_SIZE"]
+        try:
+            resp = self.app.get(BASE_URL, query_string="stream=1",
+                                headers={"Accept-Encoding": "gzip"})
+            self.assertTrue(resp.is_streamed)
+            self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+            self.assertNotIn("Content-Length", resp.headers)
+            lines = gzip.decompress(resp.get_data()).splitlines()
+        finally:
+            app.config["STREAM_CHUNK_SIZE"] = chunk_size
+        self.assertEqual([json.loads(line)["id"] for line in lines], [order.id for order in orders])
+
+    def test_compress_stream_closes_chunks(self):
+        """The chunks are closed when the client goes away or they fail"""
+        closed = []
+
+        def chunks(fail=False):
+            try:
+                yield b"first"
+                if fail:
+                    raise ValueError("failed")
+                yield b"second"
+            finally:
+                closed.append(fail)
+
+        # a client that goes away closes the response after the first chunk,
+        # the chunks are held on to so that only close() can finish them
+        inner = chunks()
+        stream = compression.compress_stream(inner, "gzip", app.config)
+        next(stream)
+        stream.close()
+        self.assertEqual(closed, [False])
+        inner = chunks(fail=True)
+        stream = compression.compress_stream(inner, "gzip", app.config)
+        self.assertRaises(ValueError, list, stream)
+        self.assertEqual(closed, [False, True])
+
+    def test_get_orders_bad_cursor(self):
+        """Get a list of orders with a cursor that can't be decoded"""
+        resp = self.app.get(BASE_URL, query_string="next=not-a-cursor")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_get_order(self):
         """Get a single order"""
         # get the id of a order
@@ -155,6 +476,151 @@ class TestCustomerOrderServer(unittest.TestCase):  # pylint: disable=too-many-pu
         
 
 
+    def test_get_order_cached(self):
+        """Reading an order twice is served from the cache"""
+        order = self._create_orders(1)[0]
+        self._add_items(order.id, 2)
+        resp = self.app.get(f"{BASE_URL}/{order.id}")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        with self._count_queries() as statements:
+            resp = self.app.get(f"{BASE_URL}/{order.id}")
+            item_id = resp.get_json()["items"][0]["item_id"]
+            resp = self.app.get(f"{BASE_URL}/{order.id}/items/{item_id}")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        # only the versions are checked, the orders and items aren't read
+        self.assertEqual(len(statements), 2)
+        for statement in statements:
+            self.assertNotIn("FROM item", statement)
+            self.assertIn("version", statement)
+        stats = self.app.get("/stats").get_json()["cache"]
+        self.assertGreaterEqual(stats["hits"], 2)
+        self.assertIn("class", self.app.get("/stats").get_json()["pool"])
+
+    def test_cached_order_invalidated_on_write(self):
+        """Writes to an order are seen by the next read"""
+        order = CustomerOrderFactory(status=Status.Received)
+        resp = self.app.post(BASE_URL, json=order.serialize(), content_type=CONTENT_TYPE_JSON)
+        order.id = resp.get_json()["id"]
+        order_url = f"{BASE_URL}/{order.id}"
+        data = self.app.get(order_url).get_json()
+        # update
+        data["address"] = "new"
+        resp = self.app.put(order_url, json=data, content_type=CONTENT_TYPE_JSON)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.app.get(order_url).get_json()["address"], "new")
+        # add and delete items
+        self._add_items(order.id, 1)
+        items = self.app.get(order_url).get_json()["items"]
+        self.assertEqual(len(items), 1)
+        self.app.post(f"{order_url}/items/batch", content_type=CONTENT_TYPE_JSON,
+                      json=[{"quantity": 1, "price": 1, "item_name": "more"}])
+        self.assertEqual(len(self.app.get(order_url).get_json()["items"]), 2)
+        self.app.delete(f"{order_url}/items/{items[0]['item_id']}")
+        self.assertEqual(len(self.app.get(order_url).get_json()["items"]), 1)
+        # cancel
+        self.app.put(f"{order_url}/cancel")
+        self.assertEqual(self.app.get(order_url).get_json()["status"], Status.Cancelled.name)
+        # delete
+        self.app.delete(order_url)
+        self.assertEqual(self.app.get(order_url).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_cached_order_written_elsewhere(self):
+        """Writes the cache wasn't told about are seen by the next read"""
+        order = self._create_orders(1)[0]
+        self._add_items(order.id, 1)
+        order_url = f"{BASE_URL}/{order.id}"
+        resp = self.app.get(order_url)
+        etag = resp.headers["ETag"]
+        stale = resp.get_json()
+        # another worker changes the order, this worker's cache isn't invalidated
+        db.session.execute(
+            CustomerOrder.__table__.update()
+            .where(CustomerOrder.__table__.c.id == order.id)
+            .values(address="elsewhere", version=CustomerOrder.__table__.c.version + 1)
+        )
+        db.session.commit()
+        resp = self.app.get(order_url, headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()["address"], "elsewhere")
+        self.assertNotEqual(resp.headers["ETag"], etag)
+        # a reader puts back the order it read before a write, which is a miss
+        CustomerOrder.cache.set(order.id, stale)
+        before = CustomerOrder.cache.stats()
+        self.assertEqual(self.app.get(order_url).get_json()["address"], "elsewhere")
+        after = CustomerOrder.cache.stats()
+        self.assertEqual((after["hits"] - before["hits"], after["misses"] - before["misses"]),
+                         (0, 1))
+        resp = self.app.get(f"{order_url}/items/{stale['items'][0]['item_id']}")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        # and one deleted elsewhere is gone
+        CustomerOrder.cache.set(order.id, stale)
+        db.session.execute(Item.__table__.delete().where(Item.__table__.c.order_id == order.id))
+        db.session.execute(CustomerOrder.__table__.delete()
+                           .where(CustomerOrder.__table__.c.id == order.id))
+        db.session.commit()
+        self.assertEqual(self.app.get(order_url).status_code, status.HTTP_404_NOT_FOUND)
+        resp = self.app.get(f"{order_url}/items/{stale['items'][0]['item_id']}")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_get_order_etag(self):
+        """Getting an order with a current ETag returns 304 Not Modified"""
+        order = self._create_orders(1)[0]
+        order_url = f"{BASE_URL}/{order.id}"
+        resp = self.app.get(order_url)
+        etag = resp.headers["ETag"]
+        self.assertFalse(etag.startswith("W/"))
+        CustomerOrder.cache.clear()
+        db.session.expunge_all()
+        with self._count_queries() as statements:
+            resp = self.app.get(order_url, headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(resp.headers["ETag"], etag)
+        self.assertEqual(resp.data, b"")
+        # only the version is read, not the order or its items
+        self.assertEqual(len(statements), 1)
+        self.assertNotIn("FROM item", statements[0])
+
+        # any change to the order or its items changes the ETag
+        self._add_items(order.id, 1)
+        resp = self.app.get(order_url, headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(resp.headers["ETag"], etag)
+        etag = resp.headers["ETag"]
+        data = resp.get_json()
+        data["address"] = "new"
+        self.app.put(order_url, json=data, content_type=CONTENT_TYPE_JSON)
+        resp = self.app.get(order_url, headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(resp.headers["ETag"], etag)
+
+        resp = self.app.get(f"{BASE_URL}/0", headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_get_item_in_other_order(self):
+        """Items can only be read through their own order"""
+        orders = self._create_orders(2)
+        self._add_items(orders[0].id, 1)
+        item_id = self.app.get(f"{BASE_URL}/{orders[0].id}").get_json()["items"][0]["item_id"]
+        resp = self.app.get(f"{BASE_URL}/{orders[1].id}/items/{item_id}")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_get_item_single_query(self):
+        """An uncached item is read with a single query"""
+        order = self._create_orders(1)[0]
+        self._add_items(order.id, 3)
+        item_id = self.app.get(f"{BASE_URL}/{order.id}").get_json()["items"][1]["item_id"]
+        CustomerOrder.cache.clear()
+        db.session.expunge_all()
+        with self._count_queries() as statements:
+            resp = self.app.get(f"{BASE_URL}/{order.id}/items/{item_id}")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()["item_id"], item_id)
+        self.assertEqual(len(statements), 1)
+        resp = self.app.get(f"{BASE_URL}/{order.id}/items/0")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        resp = self.app.get(f"{BASE_URL}/0/items/{item_id}")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
     def test_get_order_not_found(self):
         """Get a order thats not found"""
         resp = self.app.get("{}/0".format(BASE_URL))
@@ -189,6 +655,63 @@ class TestCustomerOrderServer(unittest.TestCase):  # pylint: disable=too-many-pu
             new_order["address"], test_order.address, "address do not match"
         )
 
+    def test_create_orders_batch(self):
+        """Create a batch of orders with their items"""
+        batch = []
+        for count in range(3):
+            order = CustomerOrderFactory().serialize()
+            del order["id"]
+            order["items"] = [{"quantity": 2, "price": 1.5, "item_name": f"item {i}"}
+                              for i in range(count)]
+            batch.append(order)
+        resp = self.app.post(f"{BASE_URL}/batch", json=batch, content_type=CONTENT_TYPE_JSON)
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        data = resp.get_json()
+        self.assertEqual(len(data["created"]), 3)
+        self.assertEqual(data["errors"], [])
+        for order_id, order in zip(data["created"], batch):
+            resp = self.app.get(f"{BASE_URL}/{order_id}")
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            new_order = resp.get_json()
+            self.assertEqual(new_order["customer_id"], order["customer_id"])
+            self.assertEqual(new_order["status"], order["status"])
+            self.assertEqual(sorted(item["item_name"] for item in new_order["items"]),
+                             [item["item_name"] for item in order["items"]])
+
+    def test_create_orders_batch_with_errors(self):
+        """Create a batch of orders where some of the entries are not valid"""
+        good_order = CustomerOrderFactory().serialize()
+        batch = [
+            good_order,
+            {"customer_id": 1, "status": "Received"},
+            {"customer_id": 1, "address": "here", "status": "Lost"},
+            dict(good_order, items=[{"quantity": 1, "item_name": "no price"}]),
+            "not an order",
+        ]
+        resp = self.app.post(f"{BASE_URL}/batch", json=batch, content_type=CONTENT_TYPE_JSON)
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        data = resp.get_json()
+        self.assertEqual(len(data["created"]), 1)
+        self.assertEqual([error["index"] for error in data["errors"]], [1, 2, 3, 4])
+        self.assertEqual(len(CustomerOrder.all()), 1)
+
+        resp = self.app.post(f"{BASE_URL}/batch", json=batch[1:], content_type=CONTENT_TYPE_JSON)
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(resp.get_json()["created"], [])
+
+        resp = self.app.post(f"{BASE_URL}/batch", json=good_order, content_type=CONTENT_TYPE_JSON)
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_create_orders_batch_too_large(self):
+        """Create a batch of orders that is over the size limit"""
+        app.config["MAX_BATCH_SIZE"], max_batch_size = 2, app.config["MAX_BATCH_SIZE"]
+        try:
+            batch = [CustomerOrderFactory().serialize() for _ in range(3)]
+            resp = self.app.post(f"{BASE_URL}/batch", json=batch, content_type=CONTENT_TYPE_JSON)
+        finally:
+            app.config["MAX_BATCH_SIZE"] = max_batch_size
+        self.assertEqual(resp.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
     def test_add_item(self):
         """Create a new item"""
         test_order = CustomerOrderFactory()
@@ -207,6 +730,67 @@ class TestCustomerOrderServer(unittest.TestCase):  # pylint: disable=too-many-pu
         )
         self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
 
+    def test_add_item_does_not_load_order_items(self):
+        """Adding an item to an order doesn't read the order's other items"""
+        order = self._create_orders(1)[0]
+        self._add_items(order.id, 5)
+        db.session.expunge_all()
+        with self._count_queries() as statements:
+            self._add_items(order.id, 1)
+        # only the new item itself may be read back
+        self.assertFalse([statement for statement in statements
+                          if statement.lstrip().upper().startswith("SELECT")
+                          and "FROM item" in statement
+                          and "WHERE item.id = " not in statement])
+        # the order has to exist
+        resp = self.app.post(f"{BASE_URL}/0/items",
+                             json={"order_id": 0, "quantity": 1, "price": 1, "item_name": "Egg"},
+                             content_type=CONTENT_TYPE_JSON)
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_add_items_batch(self):
+        """Add a batch of items to an order"""
+        order = self._create_orders(1)[0]
+        batch = [{"quantity": i, "price": 2.5, "item_name": f"item {i}"} for i in range(4)]
+        resp = self.app.post(f"{BASE_URL}/{order.id}/items/batch", json=batch,
+                             content_type=CONTENT_TYPE_JSON)
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        data = resp.get_json()
+        self.assertEqual(len(data), 4)
+        for item, sent in zip(data, batch):
+            self.assertEqual(item["order_id"], order.id)
+            self.assertEqual(item["item_name"], sent["item_name"])
+            resp = self.app.get(item["location"])
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            self.assertEqual(resp.get_json()["item_id"], item["item_id"])
+        resp = self.app.get(f"{BASE_URL}/{order.id}")
+        self.assertEqual(len(resp.get_json()["items"]), 4)
+        # the items are returned as they are read back
+        resp = self.app.post(f"{BASE_URL}/{order.id}/items/batch", content_type=CONTENT_TYPE_JSON,
+                             json=[{"quantity": 1, "price": 3, "item_name": "whole"}])
+        item = resp.get_json()[0]
+        self.assertIsInstance(item.pop("price"), float)
+        self.assertEqual(item.pop("location").rsplit("/", 1)[1], str(item["item_id"]))
+        read_back = self.app.get(f"{BASE_URL}/{order.id}/items/{item['item_id']}").get_json()
+        self.assertIsInstance(read_back.pop("price"), float)
+        self.assertEqual(item, read_back)
+
+    def test_add_items_batch_errors(self):
+        """Add a batch of items that is not valid"""
+        order = self._create_orders(1)[0]
+        batch = [{"quantity": 1, "price": 2.5, "item_name": "good"},
+                 {"quantity": 1, "item_name": "no price"}]
+        resp = self.app.post(f"{BASE_URL}/{order.id}/items/batch", json=batch,
+                             content_type=CONTENT_TYPE_JSON)
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("index 1", resp.get_json()["message"])
+        resp = self.app.get(f"{BASE_URL}/{order.id}")
+        self.assertEqual(resp.get_json()["items"], [])
+        # the order has to exist
+        resp = self.app.post(f"{BASE_URL}/0/items/batch", json=batch[:1],
+                             content_type=CONTENT_TYPE_JSON)
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
     def test_create_order_no_data(self):
         """Create an order with missing data"""
         resp = self.app.post(BASE_URL, json={}, content_type=CONTENT_TYPE_JSON)
@@ -307,6 +891,83 @@ class TestCustomerOrderServer(unittest.TestCase):  # pylint: disable=too-many-pu
         for orders in data:
             self.assertEqual(orders["customer_id"], test_customer_id)
 
+    def test_query_orders_by_total(self):
+        """Query Orders by total price and sort them by it"""
+        orders = self._create_orders(4)
+        for order, count in zip(orders, (2, 0, 3, 1)):
+            self._add_items(order.id, count)
+        resp = self.app.get(f"{BASE_URL}/{orders[0].id}")
+        self.assertEqual(resp.get_json()["item_count"], 2)
+        self.assertEqual(resp.get_json()["total_price"], 5.0)
+        resp = self.app.get(BASE_URL, query_string="min_total=2.5&max_total=5")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual([order["id"] for order in resp.get_json()],
+                         [orders[0].id, orders[3].id])
+        # follow the Link headers of a sorted list, the filter is kept
+        resp = self.app.get(BASE_URL, query_string="sort=-total_price&min_total=1&limit=2")
+        seen = [order["id"] for order in resp.get_json()]
+        while "Link" in resp.headers:
+            resp = self.app.get(resp.headers["Link"].split(">")[0].lstrip("<"))
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            seen.extend(order["id"] for order in resp.get_json())
+        self.assertEqual(seen, [orders[2].id, orders[0].id, orders[3].id])
+        resp = self.app.get(BASE_URL, query_string="sort=address")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_query_orders_combined(self):
+        """Query Orders by several filters at once and page through them"""
+        order_ids = []
+        for customer_id, order_status, address in (
+                (1, Status.Received, "12 Main Street"),
+                (1, Status.Cancelled, "12 Main Street"),
+                (1, Status.Processing, "12 Main Road"),
+                (1, Status.Received, "3 Elm Street"),
+                (2, Status.Received, "12 Main Street"),
+                (1, Status.Processing, "12 Main Lane")):
+            order = CustomerOrderFactory(customer_id=customer_id, status=order_status,
+                                         address=address)
+            resp = self.app.post(BASE_URL, json=order.serialize(), content_type=CONTENT_TYPE_JSON)
+            order_ids.append(resp.get_json()["id"])
+        resp = self.app.get(BASE_URL, query_string=(
+            "customer_id=1&status=Received&status=Processing&address=12%20Main&limit=2"))
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        seen = [order["id"] for order in resp.get_json()]
+        # the Link header keeps all of the filters
+        resp = self.app.get(resp.headers["Link"].split(">")[0].lstrip("<"))
+        seen.extend(order["id"] for order in resp.get_json())
+        self.assertNotIn("Link", resp.headers)
+        self.assertEqual(seen, [order_ids[0], order_ids[2], order_ids[5]])
+        resp = self.app.get(BASE_URL, query_string="status=Lost")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_report_orders(self):
+        """Report on the orders by status, customer and item"""
+        order_ids = []
+        for order_status, count in ((Status.Received, 2), (Status.Completed, 1),
+                                    (Status.Completed, 0)):
+            order = CustomerOrderFactory(status=order_status)
+            resp = self.app.post(BASE_URL, json=order.serialize(), content_type=CONTENT_TYPE_JSON)
+            order_ids.append(resp.get_json()["id"])
+            self._add_items(order_ids[-1], count)
+        resp = self.app.get("/reports/orders", query_string="group_by=status")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json(), {"group_by": "status", "groups": [
+            {"key": "Received", "orders": 1, "items": 2, "revenue": 5.0},
+            {"key": "Completed", "orders": 2, "items": 1, "revenue": 2.5},
+        ]})
+        customer_id = CustomerOrder.find(order_ids[0]).customer_id
+        resp = self.app.get("/reports/orders",
+                            query_string=f"group_by=customer&customer_id={customer_id}")
+        self.assertEqual(resp.get_json()["groups"], [
+            {"key": customer_id, "orders": 1, "items": 2, "revenue": 5.0}])
+        resp = self.app.get("/reports/orders",
+                            query_string="group_by=item&status=Completed&status=Returned")
+        self.assertEqual(resp.get_json()["groups"], [
+            {"key": "item 0", "orders": 1, "items": 1, "revenue": 2.5}])
+        for query_string in ("", "group_by=address", "group_by=status&status=Lost"):
+            resp = self.app.get("/reports/orders", query_string=query_string)
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_query_orders_by_item(self):
         """Query Orders by item name"""
         orders = self._create_orders(3)
@@ -367,6 +1028,22 @@ class TestCustomerOrderServer(unittest.TestCase):  # pylint: disable=too-many-pu
         resp = self.app.put(f"{BASE_URL}/1/cancel")
         self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
 
+    def test_cancel_order_deleted(self):
+        """Cancelling an order deleted right after the UPDATE returns 404"""
+        order = self._create_orders(1)[0]
+        db.session.execute(CustomerOrder.__table__.update()
+                           .where(CustomerOrder.__table__.c.id == order.id)
+                           .values(status=Status.Received))
+        db.session.commit()
+        with patch.object(CustomerOrder, "find_serialized", return_value=None):
+            resp = self.app.put(f"{BASE_URL}/{order.id}/cancel")
+        if db.engine.dialect.name == "postgresql":
+            # the cancelled order comes back with the UPDATE
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            self.assertEqual(resp.get_json()["status"], Status.Cancelled.name)
+        else:
+            self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
     def test_cancel_order_not_allowed(self):
         """Cancelling order with invalid status (Completed/Returned)"""
 
@@ -446,8 +1123,15 @@ class TestCustomerOrderServer(unittest.TestCase):  # pylint: disable=too-many-pu
         logging.debug(received_order)
         # try cancelling a received order
         received_order.id = data["id"]
-        resp = self.app.put(f"{BASE_URL}/{received_order.id}/cancel")
+        with self._count_queries() as statements:
+            resp = self.app.put(f"{BASE_URL}/{received_order.id}/cancel")
         self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()["status"], Status.Cancelled.name)
+        # the status is checked and changed by the first statement
+        self.assertIn("UPDATE customer_order", statements[0])
+        if db.engine.dialect.name == "postgresql":
+            # which also returns the cancelled order and its items
+            self.assertEqual(len(statements), 1)
         # try get the order back and check for status
         resp = self.app.get(f"{BASE_URL}/{received_order.id}")
         data = resp.get_json()